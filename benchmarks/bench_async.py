@@ -0,0 +1,154 @@
+"""
+Async Serving Benchmark
+
+Serves the same database with the sync gunicorn stack and the asyncio
+stack in turn, and measures the throughput and latency of the read
+endpoints with many concurrent connections.
+
+Point --database-uri at a database across the network to see the async
+stack keep serving while requests wait on the database.
+
+Usage:
+  python -m benchmarks.bench_async [--concurrency 64] [--duration 10] [--workers 2]
+                                   [--promotions 1000] [--database-uri URI]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine
+
+# the servers under test get the database to use through the environment
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+
+# pylint: disable=wrong-import-position
+from service.models import Promotion, PromotionType  # noqa: E402
+
+STACKS = {
+    "sync": [
+        sys.executable, "-m", "gunicorn", "--workers", "{workers}", "--bind", "127.0.0.1:{port}", "service:app",
+    ],
+    "async": [
+        sys.executable, "-m", "uvicorn", "service.asgi:app", "--workers", "{workers}", "--port", "{port}",
+        "--log-level", "warning",
+    ],
+}
+
+
+def seed(database_uri, count):
+    """Creates the Promotion table and fills it"""
+    engine = create_engine(database_uri)
+    Promotion.__table__.drop(engine, checkfirst=True)
+    Promotion.__table__.create(engine)
+    now = datetime.now()
+    with engine.begin() as connection:
+        connection.execute(Promotion.__table__.insert(), [
+            {"name": "Bench{}".format(i), "product_id": i % 100, "type": list(PromotionType)[i % 3], "value": 10,
+             "active": True, "start_date": now, "expiration_date": now + timedelta(days=9),
+             "version": 1, "updated_at": now}
+            for i in range(count)
+        ])
+    engine.dispose()
+
+
+def free_port():
+    """Returns a TCP port nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start(stack, workers, port, database_uri):
+    """Starts a server and waits until it answers /health"""
+    command = [part.format(workers=workers, port=port) for part in STACKS[stack]]
+    server = subprocess.Popen(
+        command, env=dict(os.environ, DATABASE_URI=database_uri),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    sys.exit(f"{stack} server did not start")
+
+
+async def load(base_url, paths, concurrency, duration):
+    """Keeps concurrency connections busy for duration seconds"""
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+
+        async def connection(offset):
+            nonlocal errors
+            request = offset
+            while time.perf_counter() < deadline:
+                start_time = time.perf_counter()
+                response = await client.get(paths[request % len(paths)])
+                latencies.append(time.perf_counter() - start_time)
+                errors += response.status_code >= 400
+                request += concurrency
+
+        await asyncio.gather(*(connection(offset) for offset in range(concurrency)))
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--promotions", type=int, default=1000)
+    parser.add_argument("--database-uri")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = args.database_uri or "sqlite:///" + os.path.join(directory, "bench.db")
+        seed(database_uri, args.promotions)
+        paths = [f"/promotions/{i}" for i in range(1, args.promotions + 1, 7)]
+        paths += [f"/promotions?product_id={i}&limit=10" for i in range(0, 100, 9)]
+        paths.append("/health")
+
+        results = {}
+        for stack in STACKS:
+            port = free_port()
+            server = start(stack, args.workers, port, database_uri)
+            try:
+                results[stack] = asyncio.run(load(f"http://127.0.0.1:{port}", paths, args.concurrency, args.duration))
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps({
+        "benchmark": "async",
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "promotions": args.promotions,
+        **results,
+        "speedup": round(results["async"]["requests_per_second"] / results["sync"]["requests_per_second"], 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
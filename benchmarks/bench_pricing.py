@@ -0,0 +1,90 @@
+"""
+Pricing Engine Benchmark
+
+Times price_lines on a catalog repricing run and compares it with pricing
+the same lines one at a time in Python.
+
+Usage:
+  python -m benchmarks.bench_pricing [--lines 100000] [--products 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+# importing the service connects to the database, which pricing never uses
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+
+# pylint: disable=wrong-import-position
+from service.models import PromotionType  # noqa: E402
+from service.pricing import price_lines  # noqa: E402
+
+
+def make_cart(lines, products, seed=42):
+    """Makes random cart lines and two promotions for every product"""
+    rng = random.Random(seed)
+    promotions = [
+        (i, i % products, rng.choice(list(PromotionType)).value, rng.choice([5, 10, 15, 20, 25, 30]))
+        for i in range(products * 2)
+    ]
+    product_ids = [rng.randrange(products) for _ in range(lines)]
+    unit_prices = [round(rng.uniform(1, 200), 2) for _ in range(lines)]
+    quantities = [rng.randint(1, 5) for _ in range(lines)]
+    return product_ids, unit_prices, quantities, promotions
+
+
+def price_lines_loop(product_ids, unit_prices, quantities, promotions):
+    """Prices every line in a Python loop, the way consumers do today"""
+    by_product = {}
+    for _, product_id, type, value in promotions:
+        by_product.setdefault(product_id, []).append((type, value))
+    totals = []
+    for product_id, unit_price, quantity in zip(product_ids, unit_prices, quantities):
+        best = 0.0
+        for type, value in by_product.get(product_id, []):
+            if type == PromotionType.BOGO.value:
+                discount = (quantity // 2) * unit_price
+            elif type == PromotionType.PERCENTAGE.value:
+                discount = unit_price * quantity * min(max(value, 0), 100) / 100
+            else:
+                discount = min(max(value, 0), unit_price) * quantity
+            best = max(best, discount)
+        totals.append(round(unit_price * quantity - best, 2))
+    return totals
+
+
+def best_of(repeat, function, *args):
+    """Returns the fastest of several timed runs in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cart = make_cart(args.lines, args.products)
+    vectorized = best_of(args.repeat, price_lines, *cart)
+    loop = best_of(args.repeat, price_lines_loop, *cart)
+    print(json.dumps({
+        "benchmark": "pricing",
+        "lines": args.lines,
+        "products": args.products,
+        "vectorized_seconds": round(vectorized, 4),
+        "vectorized_lines_per_second": round(args.lines / vectorized),
+        "loop_seconds": round(loop, 4),
+        "speedup": round(loop / vectorized, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Serialization Benchmark
+
+Times encoding a page of Promotions the old way, serialize() then
+marshal(promotion_model) then the stdlib json encoder, against the
+single-pass orjson encoder the list and item routes use now.
+
+Usage:
+  python -m benchmarks.bench_serialize [--promotions 1000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+# importing the service connects to the database, which serializing never uses
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+
+# pylint: disable=wrong-import-position
+from flask_restx import marshal  # noqa: E402
+from service import app  # noqa: E402
+from service.models import Promotion, PromotionType  # noqa: E402
+from service.routes import promotion_model  # noqa: E402
+
+
+def make_promotions(count):
+    """Makes Promotions that are never stored"""
+    start = datetime(2022, 10, 17, 9, 30)
+    return [
+        Promotion(id=i, name="Promotion{}".format(i), product_id=i % 1000, type=list(PromotionType)[i % 3],
+                  value=10, active=bool(i % 2), start_date=start, expiration_date=start + timedelta(days=9))
+        for i in range(count)
+    ]
+
+
+def marshal_path(promotions):
+    """Serializes the way the routes did before, in three passes"""
+    return json.dumps(marshal([promotion.serialize() for promotion in promotions], promotion_model)).encode()
+
+
+def best_of(repeat, function, *args):
+    """Returns the fastest of several timed runs in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--promotions", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    promotions = make_promotions(args.promotions)
+    assert json.loads(marshal_path(promotions)) == json.loads(Promotion.list_to_json(promotions))
+    with app.app_context():
+        old = best_of(args.repeat, marshal_path, promotions)
+    new = best_of(args.repeat, Promotion.list_to_json, promotions)
+    print(json.dumps({
+        "benchmark": "serialize",
+        "promotions": args.promotions,
+        "marshal_seconds": round(old, 5),
+        "orjson_seconds": round(new, 5),
+        "speedup": round(old / new, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
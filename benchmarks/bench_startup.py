@@ -0,0 +1,107 @@
+"""
+Startup Benchmark
+
+Measures the cold start of a fresh interpreter that imports the service and
+creates the app, and the memory of gunicorn workers with and without
+--preload, where the workers share the app imported by the master.
+
+Usage:
+  python -m benchmarks.bench_startup [--repeat 10] [--workers 4]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# prints the in-process timings and peak memory of one cold start
+STARTUP_SCRIPT = """
+import json, resource, service
+service.create_app()
+print(json.dumps(dict(service.startup_times, max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)))
+"""
+
+
+def cold_start(env):
+    """Starts an interpreter that creates the app and returns its timings"""
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return dict(json.loads(output.splitlines()[-1]), wall_seconds=time.perf_counter() - started)
+
+
+def free_port():
+    """Returns a TCP port nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid):
+    """Returns the resident and proportional set size of a process in KB"""
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as file:
+        fields = dict(line.split(":", 1) for line in file if line.startswith(("Rss", "Pss")))
+    return int(fields["Rss"].split()[0]), int(fields["Pss"].split()[0])
+
+
+def worker_memory(env, workers, preload):
+    """Starts gunicorn, waits for every worker and returns their average memory"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{port}", "service:app"],
+        env=dict(env, GUNICORN_PRELOAD=str(preload).lower()),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        children = []
+        while time.monotonic() < deadline and len(children) < workers:
+            time.sleep(0.5)
+            with open(f"/proc/{server.pid}/task/{server.pid}/children", encoding="utf-8") as file:
+                children = file.read().split()
+        # let the workers finish booting before measuring
+        time.sleep(2)
+        sizes = [memory_kb(pid) for pid in children]
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "worker_rss_kb": sum(rss for rss, _ in sizes) // len(sizes),
+        "worker_pss_kb": sum(pss for _, pss in sizes) // len(sizes),
+    }
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        env = dict(os.environ, DATABASE_URI=os.getenv("DATABASE_URI", "sqlite:///" + os.path.join(folder, "startup.db")))
+        runs = sorted((cold_start(env) for _ in range(args.repeat)), key=lambda run: run["wall_seconds"])
+        median = runs[len(runs) // 2]
+        memory = {
+            "no_preload": worker_memory(env, args.workers, False),
+            "preload": worker_memory(env, args.workers, True),
+        }
+
+    print(json.dumps({
+        "benchmark": "startup",
+        "repeat": args.repeat,
+        "cold_start_ms": round(median["wall_seconds"] * 1000, 1),
+        "import_ms": round(median["import_seconds"] * 1000, 1),
+        "create_app_ms": round(median["create_app_seconds"] * 1000, 1),
+        "max_rss_kb": median["max_rss_kb"],
+        "workers": args.workers,
+        **memory,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -30,13 +30,10 @@ from compare import expect
 @given('the following promotions')
 def step_impl(context):
     """ Delete all Promos and load new ones """
-    # List all of the promos and delete them one by one
+    # Delete all of the promos with one request
     rest_endpoint = f"{context.BASE_URL}/promotions"
-    context.resp = requests.get(rest_endpoint)
+    context.resp = requests.delete(rest_endpoint, params={"all": "true"})
     expect(context.resp.status_code).to_equal(200)
-    for promotion in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{promotion['id']}")
-        expect(context.resp.status_code).to_equal(204)
 
     # load the database with new promos
     for row in context.table:
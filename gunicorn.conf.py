@@ -0,0 +1,64 @@
+"""
+Gunicorn configuration
+
+The worker and thread counts come from the same environment variables that
+size the database connection pool of each worker in service/config.py
+
+Every worker writes its Prometheus metrics to PROMETHEUS_MULTIPROC_DIR so
+/metrics can report the sum over all the workers
+
+With GUNICORN_PRELOAD on (the default) the master imports the app once and
+freezes the garbage collector before forking, so the workers share the
+imported code and objects copy-on-write instead of each loading its own
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# must be set before the workers import prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus-metrics"))
+
+# the folder must exist before a preloaded app imports service.common.metrics,
+# whose gauges open their files at once, and that happens before on_starting.
+# The first master empties it of an earlier run's metrics, a config reload or
+# a master started by USR2 keeps the files of the workers still running
+if "PROMETHEUS_MULTIPROC_READY" not in os.environ:
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.environ["PROMETHEUS_MULTIPROC_READY"] = "1"
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def when_ready(server):
+    """Moves the preloaded objects out of the collector's reach before forking"""
+    if not server.cfg.preload_app:
+        return
+    # load the lazily imported pricing engine once for every worker
+    import service.pricing  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+    gc.collect()
+    # the collector never touches frozen objects, so their pages stay shared
+    gc.freeze()
+    server.log.info("Froze %d objects before forking the workers", gc.get_freeze_count())
+
+
+def post_worker_init(worker):
+    """Opens the worker's pooled connections before it accepts requests"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion
+    try:
+        with worker.wsgi.app_context():
+            Promotion.warm_pool()
+    except Exception as error:  # pylint: disable=broad-except
+        # the pool fills on demand, so a database that is down must not stop the worker
+        worker.log.warning("Could not warm the connection pool: %s", error)
+
+
+def child_exit(server, worker):
+    """Drops the live gauges of a worker that exited"""
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
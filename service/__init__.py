@@ -3,11 +3,24 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+Importing the package has no side effects on the database: create_app()
+only configures the connection, which opens on the first query. Create or
+upgrade the tables with the explicit command:
+
+    flask db-migrate
 """
-import sys
-from flask import Flask
-from service import config
-from .common import log_handlers
+import time
+
+# pylint: disable=wrong-import-position
+STARTED = time.perf_counter()
+
+from flask import Flask  # noqa: E402
+from service import config  # noqa: E402
+from .common import log_handlers  # noqa: E402
+
+# seconds spent importing the service and creating the app, for /diagnostics
+startup_times = {}
 
 # Create Flask application
 app = Flask(__name__)
@@ -16,20 +29,36 @@ app.config.from_object(config)
 # pylint: disable=wrong-import-position, wrong-import-order
 from service import routes         # noqa: E402, E261
 # pylint: disable=wrong-import-position
-from .common import error_handlers, cli_commands  # noqa: F401 E402
+from .common import error_handlers, cli_commands, compression, query_log  # noqa: F401 E402
+
+startup_times["import_seconds"] = round(time.perf_counter() - STARTED, 4)
+
+
+def create_app() -> Flask:
+    """
+    Configures the app, its logging and database connection, and returns it
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    Nothing connects to the database here, so the app can be created in a
+    gunicorn master with --preload and shared with the workers it forks.
+    Calling it again returns the same app.
+    """
+    if "sqlalchemy" in app.extensions:
+        return app
+    started = time.perf_counter()
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+    routes.init_db()
+    startup_times["create_app_seconds"] = round(time.perf_counter() - started, 4)
+    startup_times["startup_seconds"] = round(time.perf_counter() - STARTED, 4)
 
-app.logger.info(70 * "*")
-app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    app.logger.info(70 * "*")
+    app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+    app.logger.info(
+        "Service initialized in %.0f ms (imports %.0f ms)",
+        startup_times["startup_seconds"] * 1000, startup_times["import_seconds"] * 1000,
+    )
+    return app
 
-try:
-    routes.init_db()  # make our SQLAlchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+create_app()
@@ -0,0 +1,138 @@
+"""
+Asynchronous entry point for the read endpoints
+
+Serves GET /health, GET /promotions and GET /promotions/<id> on asyncio with
+an async database driver, so a worker keeps serving other connections while
+it waits on the database instead of holding a whole worker per request:
+
+    uvicorn service.asgi:app --workers 4
+
+The Flask app stays the only way to write Promotions. This app shares its
+models, filters, keyset paging, serialization and ETags, and answers the
+same query strings except count and stream.
+"""
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import parse_etags, quote_etag
+from service import config
+from service.common import status
+from service.models import DataValidationError, Promotion
+from service.routes import PAGING_ARGS, promotion_args, promotion_etag
+
+# async drivers of the databases the service runs on
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# query string arguments this app understands, with their parsers
+LIST_ARGS = {
+    argument.name: argument.type
+    for argument in promotion_args.args
+    if argument.name not in ("count", "stream")
+}
+
+
+def async_database_uri(database_uri: str) -> str:
+    """Returns the database uri with the async driver of its database"""
+    url = make_url(database_uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise DataValidationError(f"No async driver for {backend}")
+    return str(url.set(drivername=ASYNC_DRIVERS[backend]))
+
+
+def async_engine_options(database_uri: str) -> dict:
+    """Returns the connection pool options of the async engine"""
+    if database_uri.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": config.DATABASE_POOL_SIZE,
+        "max_overflow": config.DATABASE_MAX_OVERFLOW,
+        "pool_timeout": config.DATABASE_POOL_TIMEOUT,
+        "pool_recycle": config.DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": config.DATABASE_POOL_PRE_PING,
+    }
+
+
+def parse_args(query_params) -> dict:
+    """Parses the query string like the Flask collection endpoint"""
+    args = dict.fromkeys(LIST_ARGS)
+    for name, value in query_params.items():
+        if name in LIST_ARGS:
+            try:
+                args[name] = LIST_ARGS[name](value)
+            except ValueError as error:
+                raise DataValidationError(f"Invalid {name}: {error}") from error
+    return args
+
+
+def error_response(code: int, error: str, message: str) -> JSONResponse:
+    """Returns an error in the same shape as the Flask error handlers"""
+    return JSONResponse({"status": code, "error": error, "message": message}, status_code=code)
+
+
+def create_app(database_uri: str = None) -> Starlette:
+    """Creates the asyncio app with its own async engine"""
+    database_uri = database_uri or config.DATABASE_URI
+    engine = create_async_engine(async_database_uri(database_uri), **async_engine_options(database_uri))
+    sessions = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def health(request):
+        return JSONResponse({"status": "OK"}, status_code=status.HTTP_200_OK)
+
+    async def list_promotions(request):
+        args = parse_args(request.query_params)
+        filters = {key: value for key, value in args.items() if key not in PAGING_ARGS and value is not None}
+        limit = min(args["limit"] or config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX)
+        keys, descending = Promotion.sort_keys(args["sort"] or "id")
+        statement = select(Promotion).where(*Promotion.search_criteria(filters))
+        async with sessions() as session:
+            if args["after"] is not None:
+                if len(keys) > 1:
+                    result = await session.execute(select(*keys).where(Promotion.id == args["after"]))
+                    cursor = result.first()
+                else:
+                    cursor = (args["after"],)
+                statement = statement.where(Promotion.cursor_criterion(keys, descending, cursor, args["after"]))
+            statement = statement.order_by(*Promotion.sort_order(keys, descending)).limit(limit + 1)
+            promotions = (await session.execute(statement)).scalars().all()
+
+        headers = {}
+        if len(promotions) > limit:
+            promotions = promotions[:limit]
+            next_url = request.url.include_query_params(after=promotions[-1].id, limit=limit)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return JSONResponse([promotion.serialize() for promotion in promotions], headers=headers)
+
+    async def get_promotion(request):
+        promotion_id = request.path_params["promotion_id"]
+        async with sessions() as session:
+            promotion = await session.get(Promotion, promotion_id)
+        if not promotion:
+            return error_response(
+                status.HTTP_404_NOT_FOUND, "Not Found", f"Promotion with id '{promotion_id}' was not found."
+            )
+        etag = promotion_etag(promotion)
+        headers = {"ETag": quote_etag(etag)}
+        if parse_etags(request.headers.get("if-none-match")).contains(etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return JSONResponse(promotion.serialize(), headers=headers)
+
+    async def bad_request(request, error):
+        return error_response(status.HTTP_400_BAD_REQUEST, "Bad Request", str(error))
+
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/promotions", list_promotions),
+            Route("/promotions/{promotion_id:int}", get_promotion),
+        ],
+        exception_handlers={DataValidationError: bad_request},
+        on_shutdown=[engine.dispose],
+    )
+
+
+app = create_app()
@@ -1,8 +1,12 @@
 """
 Flask CLI Command Extensions
 """
+import json
+import time
+import click
 from service import app
-from service.models import db
+from service.models import db, DataValidationError, Promotion
+from service.common import loadtest, seeding, static_assets, transfer
 
 
 ######################################################################
@@ -19,3 +23,160 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to apply new tables, columns and indexes to a live database
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+def db_migrate():
+    """
+    Creates any missing tables, columns and indexes without dropping data.
+    Indexes are built concurrently on PostgreSQL so writes are not blocked,
+    and an index left invalid by a failed build is dropped and rebuilt.
+    """
+    try:
+        changes = Promotion.migrate()
+    except DataValidationError as error:
+        raise click.ClickException(str(error))
+    for change in changes:
+        click.echo(change)
+    click.echo(f"Database is up to date ({len(changes)} changes applied)")
+
+
+######################################################################
+# Command to build the content-hashed, precompressed static assets
+# Usage:
+#   flask build-static
+######################################################################
+@app.cli.command("build-static")
+def build_static():
+    """
+    Writes hashed, gzip and brotli copies of the static assets to static/dist.
+    Run it when building the image so the admin UI is cached by browsers.
+    """
+    manifest = static_assets.build(app.static_folder)
+    click.echo(f"Built {len(manifest)} assets into {static_assets.DIST_FOLDER}")
+
+
+######################################################################
+# Command to fill the database with realistic Promotions
+# Usage:
+#   flask seed-promotions --count 100000 --products 5000
+######################################################################
+@app.cli.command("seed-promotions")
+@click.option("--count", default=10000, show_default=True, help="Promotions to add")
+@click.option("--products", default=1000, show_default=True, help="Distinct product ids to spread them over")
+@click.option("--chunk-size", default=10000, show_default=True, help="Rows loaded per statement")
+@click.option("--seed", type=int, help="Random seed, for repeatable data")
+def seed_promotions(count, products, chunk_size, seed):
+    """
+    Bulk loads realistic Promotions, with COPY on PostgreSQL and batched
+    INSERTs elsewhere. New Promotions are added after the existing ones.
+    """
+    started = time.perf_counter()
+    loaded = seeding.seed_promotions(
+        count, products, chunk_size, seed, progress=lambda loaded: click.echo(f"Loaded {loaded}/{count}")
+    )
+    seconds = time.perf_counter() - started
+    click.echo(f"Seeded {loaded} Promotions in {seconds:.1f}s ({loaded / max(seconds, 1e-9):.0f} rows/s)")
+
+
+######################################################################
+# Command to load test the app in process
+# Usage:
+#   flask loadtest --requests 10000 --concurrency 16 --mix list=40,get=30,filter=20,create=5,activate=5
+######################################################################
+@app.cli.command("loadtest")
+@click.option("--requests", default=1000, show_default=True, help="Requests to send in total")
+@click.option("--concurrency", default=8, show_default=True, help="Threads sending requests at once")
+@click.option("--mix", default=loadtest.DEFAULT_MIX, show_default=True, help="operation=weight pairs")
+@click.option("--seed", type=int, help="Random seed, for repeatable runs")
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON")
+def load_test(requests, concurrency, mix, seed, as_json):
+    """
+    Sends a mix of list, get, filter, create and activate requests to the
+    app from many threads and reports the latency of each.
+    """
+    try:
+        results = loadtest.run(app, requests, max(concurrency, 1), loadtest.parse_mix(mix), seed)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo(
+        f"{results['requests']} requests in {results['seconds']}s, "
+        f"{results['requests_per_second']} requests/s, {results['errors']} errors"
+    )
+    for name, result in results["operations"].items():
+        click.echo(
+            f"\n{name}: {result['requests']} requests, {result['errors']} errors, "
+            f"p50 {result['p50_ms']}ms, p90 {result['p90_ms']}ms, p99 {result['p99_ms']}ms, max {result['max_ms']}ms"
+        )
+        largest = max(result["buckets"].values())
+        for bucket, bucket_count in result["buckets"].items():
+            if bucket_count:
+                click.echo(f"  {bucket:>9} {bucket_count:>7} {'#' * max(1, 40 * bucket_count // largest)}")
+
+
+######################################################################
+# Commands to move promotion catalogs between environments
+# Usage:
+#   flask promotions-export promotions.csv
+#   flask promotions-import promotions.csv
+######################################################################
+@app.cli.command("promotions-export")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(transfer.FORMATS), help="Defaults to the file extension")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows fetched at a time")
+def promotions_export(path, fmt, batch_size):
+    """
+    Writes every Promotion to a CSV or JSON Lines file in constant memory.
+    PostgreSQL writes CSV files itself with COPY.
+    """
+    try:
+        fmt = transfer.file_format(path, fmt)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    progress = transfer.Progress(
+        lambda progress: click.echo(f"Exported {progress.rows} Promotions ({progress.rows_per_second:.0f} rows/s)")
+    )
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        transfer.export_promotions(file, fmt, batch_size, progress)
+    click.echo(f"Exported {progress.rows} Promotions to {path} ({progress.rows_per_second:.0f} rows/s)")
+
+
+@app.cli.command("promotions-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(transfer.FORMATS), help="Defaults to the file extension")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows loaded per transaction")
+@click.option("--checkpoint", "checkpoint_path", help="Progress file, defaults to PATH.checkpoint")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start from the first row")
+def promotions_import(path, fmt, batch_size, checkpoint_path, restart):
+    """
+    Validates and loads the Promotions of a CSV or JSON Lines file in
+    constant memory, with COPY on PostgreSQL. Rows that fail validation or
+    whose name is taken are reported and skipped. An interrupted import
+    continues from its checkpoint when it is run again.
+    """
+    checkpoint = transfer.Checkpoint(checkpoint_path or path + ".checkpoint", path)
+    try:
+        fmt = transfer.file_format(path, fmt)
+        if not restart and checkpoint.load():
+            click.echo(f"Resuming after row {checkpoint.row} ({checkpoint.rows} Promotions imported)")
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    progress = transfer.Progress(
+        lambda progress: click.echo(
+            f"Imported {progress.rows} Promotions, {progress.errors} rejected ({progress.rows_per_second:.0f} rows/s)"
+        )
+    )
+    transfer.import_promotions(
+        path, fmt, batch_size, checkpoint, progress,
+        report_error=lambda row, message: click.echo(f"Row {row}: {message}", err=True),
+    )
+    checkpoint.remove()
+    click.echo(f"Imported {progress.rows} Promotions from {path}, {progress.errors} rejected")
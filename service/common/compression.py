@@ -0,0 +1,123 @@
+"""
+Response Compression
+
+Compresses dynamic responses with brotli or gzip, whichever the client
+prefers. Buffered responses are only compressed above COMPRESS_MIN_SIZE,
+streamed responses are compressed chunk by chunk and flushed after every
+chunk so clients still receive rows as they are fetched.
+
+Responses that already have a Content-Encoding, such as the precompressed
+static assets, are left alone.
+
+A compressed response is a different representation, so a strong ETag gets
+the encoding as a suffix ("12-3-br") and etag_matches accepts both forms.
+"""
+import zlib
+import brotli
+from flask import request
+from service import app
+
+# media types worth compressing, images and archives are compressed already
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+    "text/",
+)
+
+# encodings this service can produce, in order of preference on a tie
+ENCODINGS = ("br", "gzip")
+
+
+def choose_encoding(accept_encodings, encodings=ENCODINGS) -> str:
+    """Returns the encoding a client accepts best out of encodings, or None"""
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Returns the entity tag of a representation compressed with encoding"""
+    return f"{etag}-{encoding}"
+
+
+def etag_matches(etags, etag: str) -> bool:
+    """Checks whether a parsed If-Match or If-None-Match names any encoding of etag"""
+    return etags.contains(etag) or any(etags.contains(encoded_etag(etag, encoding)) for encoding in ENCODINGS)
+
+
+def compressor(encoding):
+    """Returns (compress, flush, finish) functions of a new streaming encoder"""
+    if encoding == "br":
+        encoder = brotli.Compressor(quality=app.config["COMPRESS_BROTLI_QUALITY"])
+        return encoder.process, encoder.flush, encoder.finish
+    encoder = zlib.compressobj(app.config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 31)
+    return encoder.compress, lambda: encoder.flush(zlib.Z_SYNC_FLUSH), encoder.flush
+
+
+def compress_stream(chunks, encoding):
+    """Compresses an iterable of chunks, flushing after each one"""
+    compress, flush, finish = compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if chunk:
+            yield compress(chunk) + flush()
+    yield finish()
+
+
+def is_compressible(response) -> bool:
+    """Checks whether a response may be compressed at all"""
+    return (
+        request.method != "HEAD"
+        and 200 <= response.status_code < 300
+        and response.status_code != 204
+        and "Content-Encoding" not in response.headers
+        and not response.direct_passthrough
+        and response.mimetype.startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def revalidated(response):
+    """Gives a 304 the tag of the encoded representation the client revalidated"""
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        for encoding in ENCODINGS:
+            if request.if_none_match.contains(encoded_etag(etag, encoding)):
+                response.set_etag(encoded_etag(etag, encoding))
+                break
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses a response with the encoding the client prefers"""
+    if not app.config["COMPRESS_ENABLED"]:
+        return response
+    if response.status_code == 304:
+        return revalidated(response)
+    if not is_compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        compress, _, finish = compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
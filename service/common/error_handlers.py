@@ -18,8 +18,9 @@
 Module: error_handlers
 """
 from flask import jsonify
-from service.models import DataValidationError
+from service.models import DataValidationError, DataConflictError
 from service import app
+from service.routes import api
 from . import status
 
 
@@ -32,6 +33,32 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@app.errorhandler(DataConflictError)
+def request_conflict_error(error):
+    """Handles writes that lost a race with another request"""
+    return resource_conflict(error)
+
+
+# flask-restx handles the errors of its resources before Flask does, so the
+# model errors are registered with the Api too, which wants a dict back
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """Handles Value Errors from bad data sent to the REST API"""
+    message = str(error)
+    app.logger.warning(message)
+    return {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message}, \
+        status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(DataConflictError)
+def api_conflict_error(error):
+    """Handles REST API writes that lost a race with another request"""
+    message = str(error)
+    app.logger.warning(message)
+    return {"status": status.HTTP_409_CONFLICT, "error": "Conflict", "message": message}, \
+        status.HTTP_409_CONFLICT
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
@@ -86,6 +113,21 @@ def resource_conflict(error):
     )
 
 
+@app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles failed conditional requests with HTTP_412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
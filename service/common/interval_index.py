@@ -0,0 +1,72 @@
+"""
+Interval Index
+
+This module contains an in-memory index of closed [start, end] intervals
+that answers which intervals contain a point in O(log n + k), and a sweep
+that answers many points at once
+"""
+import heapq
+from bisect import bisect_right
+
+
+class IntervalIndex:
+    """
+    Immutable index of closed intervals sorted by their start
+
+    The starts are kept in one sorted array so a lookup bisects to the
+    intervals that have started, and a running maximum of the ends lets
+    the scan stop as soon as nothing earlier can still be open
+    """
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals (iterable): (start, end, item) tuples
+        """
+        entries = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [start for start, _, _ in entries]
+        self._ends = [end for _, end, _ in entries]
+        self._items = [item for _, _, item in entries]
+        # _max_ends[i] is the latest end of any interval up to and including i
+        self._max_ends = []
+        latest = None
+        for end in self._ends:
+            latest = end if latest is None or end > latest else latest
+            self._max_ends.append(latest)
+
+    def __len__(self):
+        return len(self._items)
+
+    def containing(self, point) -> list:
+        """Returns the items of every interval with start <= point <= end, by start"""
+        found = []
+        index = bisect_right(self._starts, point) - 1
+        while index >= 0 and self._max_ends[index] >= point:
+            if self._ends[index] >= point:
+                found.append(self._items[index])
+            index -= 1
+        found.reverse()
+        return found
+
+    def sweep(self, points) -> list:
+        """Returns the items containing each point, in the order of the points
+
+        The points are sorted and swept once: intervals enter a heap keyed by
+        their end as the sweep passes their start and leave it once the sweep
+        passes their end, so n points cost O((n + m) log m) plus the output
+        instead of n separate lookups
+        """
+        points = list(points)
+        order = sorted(range(len(points)), key=points.__getitem__)
+        found = [None] * len(points)
+        open_ends = []
+        index = 0
+        for position in order:
+            point = points[position]
+            while index < len(self._starts) and self._starts[index] <= point:
+                heapq.heappush(open_ends, (self._ends[index], index))
+                index += 1
+            while open_ends and open_ends[0][0] < point:
+                heapq.heappop(open_ends)
+            found[position] = [self._items[i] for i in sorted(i for _, i in open_ends)]
+        return found
@@ -0,0 +1,186 @@
+"""
+In-process Load Generator
+
+Drives the WSGI app from many threads with a weighted mix of requests and
+records the latency of each kind of request, so production load can be
+reproduced on a laptop without external tools. Requests go through the
+Flask test client, so they run every request hook but skip the network.
+"""
+import bisect
+import itertools
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from service.models import Promotion, PromotionType, db
+
+# the default request mix, as operation=weight pairs
+DEFAULT_MIX = "list=40,get=30,filter=20,create=5,activate=5"
+
+# upper bounds of the latency histogram buckets in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# existing Promotions sampled for the get, filter and activate requests
+SAMPLE_SIZE = 1000
+
+
+def parse_mix(mix: str) -> dict:
+    """Parses "list=40,get=30" into {"list": 40, "get": 30}"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation {}, use one of {}".format(name, ", ".join(OPERATIONS)))
+        try:
+            weights[name] = int(weight)
+        except ValueError:
+            raise ValueError("Weight of {} must be an integer".format(name))
+        if weights[name] < 0:
+            raise ValueError("Weight of {} must not be negative".format(name))
+    if not sum(weights.values()):
+        raise ValueError("The mix needs at least one operation with a weight")
+    return weights
+
+
+def list_promotions(client, rng, sample):
+    """Lists the first page of Promotions"""
+    return client.get("/promotions?limit=20")
+
+
+def get_promotion(client, rng, sample):
+    """Reads one Promotion"""
+    return client.get("/promotions/{}".format(rng.choice(sample["ids"])))
+
+
+def filter_promotions(client, rng, sample):
+    """Filters the Promotions by product or type"""
+    if rng.random() < 0.5:
+        return client.get("/promotions?product_id={}".format(rng.choice(sample["product_ids"])))
+    return client.get("/promotions?type={}&limit=20".format(rng.choice(list(PromotionType)).name))
+
+
+def create_promotion(client, rng, sample):
+    """Creates a Promotion with a unique name"""
+    start_date = datetime.now().replace(microsecond=0)
+    return client.post("/promotions", json={
+        "name": "Load{}".format(uuid.uuid4().hex[:16]),
+        "product_id": rng.choice(sample["product_ids"]),
+        "type": PromotionType.PERCENTAGE.name,
+        "value": 10,
+        "active": False,
+        "start_date": start_date.isoformat(),
+        "expiration_date": (start_date + timedelta(days=7)).isoformat(),
+    })
+
+
+def activate_promotion(client, rng, sample):
+    """Activates or deactivates a Promotion"""
+    action = rng.choice(("activate", "deactivate"))
+    return client.put("/promotions/{}/{}".format(rng.choice(sample["ids"]), action))
+
+
+OPERATIONS = {
+    "list": list_promotions,
+    "get": get_promotion,
+    "filter": filter_promotions,
+    "create": create_promotion,
+    "activate": activate_promotion,
+}
+
+
+class LatencyHistogram:
+    """
+    Latencies of one operation, kept whole for exact percentiles
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def add(self, seconds: float, failed: bool):
+        """Records the latency of one request"""
+        self.latencies.append(seconds)
+        self.errors += failed
+
+    def summary(self, elapsed: float) -> dict:
+        """Returns the count, errors, throughput, percentiles and bucket counts"""
+        latencies = sorted(self.latencies)
+        buckets = [0] * (len(BUCKETS_MS) + 1)
+        for seconds in latencies:
+            buckets[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+        def percentile(share):
+            return round(latencies[min(int(len(latencies) * share), len(latencies) - 1)] * 1000, 2)
+
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "buckets": {
+                ("<={}ms".format(bound) if bound else ">{}ms".format(BUCKETS_MS[-1])): count
+                for bound, count in zip(BUCKETS_MS + (None,), buckets)
+            },
+        }
+
+
+def run(app, requests: int, concurrency: int, mix: dict, seed: int = None) -> dict:
+    """
+    Sends requests from concurrency threads and returns a summary per operation
+
+    Args:
+        app: the Flask app to drive
+        requests (int): how many requests to send in total
+        concurrency (int): how many threads send requests at once
+        mix (dict): the weight of each operation, from parse_mix()
+        seed (int): seed of the random choices, for repeatable runs
+    """
+    names = [name for name, weight in mix.items() if weight]
+    ids = [promotion_id for (promotion_id,) in db.session.query(Promotion.id).limit(SAMPLE_SIZE)]
+    if not ids and set(names) & {"get", "activate"}:
+        raise ValueError("There are no Promotions to get or activate, run flask seed-promotions first")
+    sample = {
+        "ids": ids,
+        "product_ids": [
+            product_id for (product_id,) in db.session.query(Promotion.product_id).distinct().limit(SAMPLE_SIZE)
+        ] or [0],
+    }
+    cumulative = list(itertools.accumulate(mix[name] for name in names))
+    histograms = {name: LatencyHistogram() for name in names}
+    lock = threading.Lock()
+
+    def worker(number, count):
+        rng = random.Random(None if seed is None else seed + number)
+        client = app.test_client()
+        for _ in range(count):
+            name = rng.choices(names, cum_weights=cumulative)[0]
+            started = time.perf_counter()
+            response = OPERATIONS[name](client, rng, sample)
+            seconds = time.perf_counter() - started
+            with lock:
+                histograms[name].add(seconds, response.status_code >= 400)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(worker, number, requests // concurrency + (number < requests % concurrency))
+            for number in range(concurrency)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    results = {name: histogram.summary(elapsed) for name, histogram in histograms.items() if histogram.latencies}
+    total = sum(result["requests"] for result in results.values())
+    return {
+        "requests": total,
+        "errors": sum(result["errors"] for result in results.values()),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        "operations": results,
+    }
@@ -0,0 +1,133 @@
+"""
+Prometheus Metrics
+
+Records request latency, in-flight requests, payload sizes, database
+query timings and the lookup cache and connection pool counters, and
+renders them for GET /metrics.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(gunicorn.conf.py sets it up), and /metrics adds the samples of all the
+workers together, whichever worker answers the scrape.
+"""
+import os
+import threading
+import time
+from flask import request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, REGISTRY
+)
+from service import app
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent answering a request", ["route", "method", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being answered", multiprocess_mode="livesum",
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response body as sent", ["route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+# observed by the statement timing hook of service.common.query_log
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time spent running a database statement", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CACHE_EVENTS = Counter("promotion_cache_events", "Lookup cache hits, misses and evictions", ["event"])
+CACHE_SIZE = Gauge("promotion_cache_entries", "Entries in the lookup cache", multiprocess_mode="livesum")
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Pooled database connections by state", ["state"], multiprocess_mode="livesum",
+)
+POOL_CHECKOUTS = Counter("db_pool_checkouts", "Connections checked out of the pool")
+POOL_TIMEOUTS = Counter("db_pool_timeouts", "Checkouts that timed out waiting for a connection")
+POOL_WAIT = Counter("db_pool_wait_seconds", "Time spent waiting for a pooled connection")
+
+# the environ key holding when a request started
+STARTED = "service.metrics.started"
+
+
+class CounterExport:
+    """
+    Adds the growth of in-process counters to Prometheus counters
+    """
+
+    def __init__(self):
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def inc(self, counter, key, value):
+        """Increments counter by how much value grew since the last call"""
+        with self._lock:
+            last = self._last.get(key, 0)
+            self._last[key] = value
+        # a counter that was reset starts over from zero
+        counter.inc(value - last if value >= last else value)
+
+
+counters = CounterExport()
+
+
+def route_name() -> str:
+    """Returns the Resource class or view function that answered the request"""
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return "unmatched"
+    view_class = getattr(view, "view_class", None)
+    return view_class.__name__ if view_class else request.endpoint
+
+
+def record_stats():
+    """Copies the cache and pool counters of this process into the metrics"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion
+    cache = Promotion.cache.stats()
+    CACHE_SIZE.set(cache["size"])
+    for name in ("hits", "misses", "evictions"):
+        counters.inc(CACHE_EVENTS.labels(name), "cache_" + name, cache[name])
+    pool = Promotion.pool_stats()
+    if "checkouts" in pool:
+        for state in ("checked_in", "checked_out", "overflow"):
+            POOL_CONNECTIONS.labels(state).set(pool[state])
+        counters.inc(POOL_CHECKOUTS, "pool_checkouts", pool["checkouts"])
+        counters.inc(POOL_TIMEOUTS, "pool_timeouts", pool["timeouts"])
+        counters.inc(POOL_WAIT, "pool_wait", pool["wait_seconds_total"])
+
+
+def render():
+    """Returns the metrics of every worker in the Prometheus text format"""
+    record_stats()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+@app.before_request
+def start_request():
+    """Counts a request in flight and notes when it started"""
+    request.environ[STARTED] = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request(response):
+    """Records the latency and payload size of a request"""
+    started = request.environ.get(STARTED)
+    if started is not None:
+        route = route_name()
+        REQUEST_LATENCY.labels(route, request.method, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+        if response.content_length is not None:
+            RESPONSE_SIZE.labels(route).observe(response.content_length)
+        record_stats()
+    return response
+
+
+@app.teardown_request
+def finish_request(_error):
+    """Counts a request as answered, even when it failed"""
+    if request.environ.pop(STARTED, None) is not None:
+        REQUESTS_IN_FLIGHT.dec()
@@ -0,0 +1,136 @@
+"""
+SQL Query Log
+
+Counts the statements each request runs and how long they take.
+
+- Statements slower than SQL_SLOW_QUERY_MS are logged with the types of
+  their bound parameters, never the values
+- A statement run SQL_REPEAT_THRESHOLD times or more in one request is
+  logged as a likely N+1 pattern
+- In debug mode, or with SQL_TIMING_HEADERS on, responses carry the
+  statement count in X-DB-Queries and the database time and slowest
+  statement in Server-Timing
+
+The same engine hook feeds the db_query_duration_seconds metric, so every
+statement is timed once.
+"""
+import logging
+import time
+from collections import Counter
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service import app
+from service.common.metrics import DB_QUERY_DURATION
+
+logger = logging.getLogger("flask.app")
+
+# the environ key holding the statements of a request
+QUERIES = "service.query_log.queries"
+
+# the connection info key holding when each running statement started
+STARTED = "service.query_log.started"
+
+
+class RequestQueries:
+    """
+    The statements run while answering one request
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = (0.0, None)
+        self.statements = Counter()
+
+    def add(self, statement: str, seconds: float):
+        """Records one statement"""
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+    def repeated(self, threshold: int) -> list:
+        """Returns (statement, count) of the statements run threshold times or more"""
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def server_timing(self) -> str:
+        """Returns the Server-Timing header value"""
+        timing = f'db;dur={self.seconds * 1000:.2f};desc="{self.count} queries"'
+        if self.slowest[1] is not None:
+            timing += f', db-slowest;dur={self.slowest[0] * 1000:.2f};desc="{operation(self.slowest[1])}"'
+        return timing
+
+
+def operation(statement: str) -> str:
+    """Returns the SQL verb a statement starts with"""
+    words = statement.split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def redact(parameters, executemany=False):
+    """Replaces the bound parameter values with their type names"""
+    if executemany:
+        return f"<{len(parameters)} parameter sets>"
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def current_queries():
+    """Returns the statements of the current request, or None outside a request"""
+    if not has_request_context():
+        return None
+    return request.environ.get(QUERIES)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    """Notes when a statement started"""
+    conn.info.setdefault(STARTED, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def finish_statement(conn, cursor, statement, parameters, context, executemany):
+    """Records a statement in the metrics and the current request, and logs it when it was slow"""
+    seconds = time.perf_counter() - conn.info[STARTED].pop()
+    DB_QUERY_DURATION.labels(operation(statement)).observe(seconds)
+    queries = current_queries()
+    if queries is not None:
+        queries.add(statement, seconds)
+    if seconds * 1000 >= app.config["SQL_SLOW_QUERY_MS"]:
+        logger.warning(
+            "Slow query (%.1f ms): %s parameters=%s", seconds * 1000, " ".join(statement.split()),
+            redact(parameters, executemany),
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def forget_statement(context):
+    """Drops the start time of a statement that failed"""
+    if context.connection is not None and context.connection.info.get(STARTED):
+        context.connection.info[STARTED].pop()
+
+
+@app.before_request
+def start_queries():
+    """Starts counting the statements of a request"""
+    request.environ[QUERIES] = RequestQueries()
+
+
+@app.after_request
+def report_queries(response):
+    """Flags repeated statements and adds the timing headers"""
+    queries = request.environ.get(QUERIES)
+    if queries is None:
+        return response
+    for statement, count in queries.repeated(app.config["SQL_REPEAT_THRESHOLD"]):
+        logger.warning(
+            "Likely N+1 query in %s %s, run %d times: %s",
+            request.method, request.path, count, " ".join(statement.split()),
+        )
+    if app.debug or app.config["SQL_TIMING_HEADERS"]:
+        response.headers["X-DB-Queries"] = str(queries.count)
+        response.headers["Server-Timing"] = queries.server_timing()
+    return response
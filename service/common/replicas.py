@@ -0,0 +1,157 @@
+"""
+Read Replicas
+
+Sends the SELECTs of the database session to read replicas and everything
+else to the primary database.
+
+- Replicas are used round-robin, a replica whose connection fails is
+  ejected for REPLICA_EJECT_SECONDS and then tried again
+- Once a session writes, it reads from the primary until the transaction
+  ends, so it sees its own uncommitted rows
+- Requests that write, send an X-Read-Your-Writes header, or come from a
+  client that wrote in the last READ_YOUR_WRITES_SECONDS (a flag kept in
+  the Flask session) read from the primary too
+- A request counts as a write unless its method only reads or its view is
+  marked with @read_only, like the POST searches whose query is the body
+"""
+import itertools
+import threading
+import time
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm
+
+# requests with these methods only read, anything else counts as a write
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# the request header that asks to read from the primary
+READ_YOUR_WRITES_HEADER = "X-Read-Your-Writes"
+
+# the Flask session key holding when the last write's reads may go back to replicas
+PRIMARY_UNTIL = "primary_until"
+
+
+class ReplicaRouter:
+    """
+    Round-robin choice of healthy read replicas
+    """
+
+    def __init__(self):
+        self.engines = []
+        self.eject_seconds = 0
+        self._ejected = {}
+        self._next = itertools.cycle([])
+        self._lock = threading.Lock()
+
+    def configure(self, database_uris: list, engine_options: dict, eject_seconds: float):
+        """Creates an engine per replica, replacing any earlier ones"""
+        self.dispose()
+        self.engines = [create_engine(uri, **engine_options) for uri in database_uris]
+        self.eject_seconds = eject_seconds
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._handle_error)
+        with self._lock:
+            self._ejected = {}
+            self._next = itertools.cycle(self.engines)
+
+    def dispose(self):
+        """Closes the connections of every replica"""
+        for engine in self.engines:
+            engine.dispose()
+        self.engines = []
+
+    def choose(self):
+        """Returns the next healthy replica engine, or None when there is none"""
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.engines)):
+                engine = next(self._next)
+                if self._ejected.get(engine, 0) <= now:
+                    self._ejected.pop(engine, None)
+                    return engine
+        return None
+
+    def eject(self, engine):
+        """Stops reading from a replica for eject_seconds"""
+        with self._lock:
+            self._ejected[engine] = time.monotonic() + self.eject_seconds
+
+    def _handle_error(self, context):
+        if context.is_disconnect or context.connection is None or context.connection.invalidated:
+            self.eject(context.engine)
+
+    def stats(self) -> dict:
+        """Returns how many replicas there are and which are ejected"""
+        now = time.monotonic()
+        with self._lock:
+            ejected = [
+                engine.url.render_as_string(hide_password=True)
+                for engine, until in self._ejected.items() if until > now
+            ]
+        return {"replicas": len(self.engines), "ejected": ejected}
+
+
+def read_only(view):
+    """Marks a view, or a method of a view class, that only reads whatever its HTTP method"""
+    view.read_only = True
+    return view
+
+
+def is_write() -> bool:
+    """Checks whether the current request may write"""
+    if request.method in READ_METHODS:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    # class based views, like the flask-restx resources, are marked on their method
+    handler = getattr(getattr(view, "view_class", None), request.method.lower(), view)
+    return not getattr(handler, "read_only", False)
+
+
+def read_your_writes() -> bool:
+    """Checks whether the current request must read from the primary"""
+    if not has_request_context():
+        return False
+    return (
+        is_write()
+        or bool(request.headers.get(READ_YOUR_WRITES_HEADER))
+        or session.get(PRIMARY_UNTIL, 0) > time.time()
+    )
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that reads from the replicas of its SQLAlchemy object
+    """
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.replicas = db.replicas
+        self.wrote = False
+        event.listen(self, "after_commit", self._end_transaction)
+        event.listen(self, "after_rollback", self._end_transaction)
+
+    def _end_transaction(self, _session):
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        reads = getattr(clause, "is_select", False) and not self._flushing
+        if reads and not self.wrote and self.replicas.engines and not read_your_writes():
+            engine = self.replicas.choose()
+            if engine is not None:
+                return engine
+        if not reads:
+            self.wrote = True
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy object whose sessions read from the configured replicas
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.replicas = ReplicaRouter()
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,67 @@
+"""
+Promotion Seeding
+
+Makes realistic Promotions for load tests and demos. Types and values follow
+the choices of tests/factory.py PromotionFactory, the dates are spread around
+today so some Promotions are running, some are over and some are to come.
+"""
+import random
+from datetime import datetime, timedelta
+from service.models import Promotion, PromotionType
+
+# the values PromotionFactory picks from, BOGO Promotions have no value
+VALUES = (5, 10, 15, 20, 25, 30)
+
+# share of the seeded Promotions that are active
+ACTIVE_SHARE = 0.8
+
+
+def promotion_rows(count: int, products: int, first: int = 0, seed: int = None):
+    """
+    Yields the column values of count Promotions
+
+    Args:
+        count (int): how many Promotions to make
+        products (int): product ids are drawn from 0 to products - 1
+        first (int): number of the first Promotion, so names stay unique across runs
+        seed (int): seed of the random choices, for repeatable data
+    """
+    rng = random.Random(seed)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for number in range(first, first + count):
+        promotion_type = rng.choice(list(PromotionType))
+        start_date = today + timedelta(days=rng.randint(-60, 30))
+        yield {
+            "name": "Promotion{}".format(number),
+            "product_id": rng.randrange(products),
+            "type": promotion_type,
+            "value": 0 if promotion_type == PromotionType.BOGO else rng.choice(VALUES),
+            "active": rng.random() < ACTIVE_SHARE,
+            "start_date": start_date,
+            "expiration_date": start_date + timedelta(days=rng.randint(1, 90)),
+        }
+
+
+def seed_promotions(count: int, products: int, chunk_size: int, seed: int = None, progress=None) -> int:
+    """
+    Bulk loads count new Promotions in chunks of chunk_size rows
+
+    Names continue after the highest id in the table. progress is called with
+    the number of rows loaded so far after every chunk
+    Returns the number of Promotions loaded
+    """
+    first = (Promotion.query.with_entities(Promotion.id).order_by(Promotion.id.desc()).limit(1).scalar() or 0) + 1
+    loaded = 0
+    chunk = []
+    for row in promotion_rows(count, products, first, seed):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            loaded += Promotion.bulk_load(chunk)
+            chunk = []
+            if progress:
+                progress(loaded)
+    if chunk:
+        loaded += Promotion.bulk_load(chunk)
+        if progress:
+            progress(loaded)
+    return loaded
@@ -0,0 +1,87 @@
+"""
+Static Assets
+
+Builds the admin UI assets for production: every file under the static
+folder is copied to static/dist under a name that includes a hash of its
+content, next to gzip and brotli compressed copies. A change to a file
+gives it a new name, so the copies can be cached forever.
+
+The build writes a manifest of original to hashed names and an index.html
+that links to the hashed names.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import brotli
+
+DIST_FOLDER = "dist"
+MANIFEST = "manifest.json"
+INDEX = "index.html"
+
+# file extension of each precompressed copy, by Content-Encoding
+ENCODING_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+# files that are never worth compressing
+PRECOMPRESSED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2", ".gz", ".br")
+
+
+def hashed_name(path: str, content: bytes) -> str:
+    """Returns a path with a hash of the content before its extension"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+
+def build(static_folder: str) -> dict:
+    """
+    Writes the hashed and compressed copies of every static asset
+
+    Args:
+        static_folder (str): the static folder of the app
+
+    Returns:
+        dict: the manifest that maps each asset to its hashed name
+    """
+    dist = os.path.join(static_folder, DIST_FOLDER)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+    for folder, folders, files in os.walk(static_folder):
+        if folder == static_folder:
+            folders[:] = [name for name in folders if name != DIST_FOLDER]
+        for name in sorted(files):
+            source = os.path.join(folder, name)
+            path = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            if path == INDEX:
+                continue
+            with open(source, "rb") as file:
+                content = file.read()
+            manifest[path] = hashed_name(path, content)
+            write_asset(os.path.join(dist, manifest[path]), content)
+
+    with open(os.path.join(static_folder, INDEX), encoding="utf-8") as file:
+        index = file.read()
+    # longest paths first so no asset is replaced inside a longer one
+    for path in sorted(manifest, key=len, reverse=True):
+        index = index.replace(f"static/{path}", f"assets/{manifest[path]}")
+    with open(os.path.join(dist, INDEX), "w", encoding="utf-8") as file:
+        file.write(index)
+    with open(os.path.join(dist, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+def write_asset(target: str, content: bytes):
+    """Writes an asset with its .gz and .br copies when they are smaller"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as file:
+        file.write(content)
+    if target.endswith(PRECOMPRESSED_EXTENSIONS):
+        return
+    encoders = {"gzip": lambda data: gzip.compress(data, 9, mtime=0), "br": brotli.compress}
+    for encoding, compress in encoders.items():
+        extension = ENCODING_EXTENSIONS[encoding]
+        compressed = compress(content)
+        if len(compressed) < len(content):
+            with open(target + extension, "wb") as file:
+                file.write(compressed)
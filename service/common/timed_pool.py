@@ -0,0 +1,66 @@
+"""
+Timed Queue Pool
+
+This module contains a SQLAlchemy QueuePool that keeps statistics about
+how long requests wait for a database connection
+"""
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that counts checkouts, timeouts and the time spent waiting
+
+    The wait includes opening a new connection when the pool has none idle,
+    which is where the time goes when many workers restart at once
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+    def recreate(self):
+        # invalidating the pool replaces it, so carry the counters over
+        pool = super().recreate()
+        with self._stats_lock:
+            pool._checkouts = self._checkouts
+            pool._timeouts = self._timeouts
+            pool._wait_total = self._wait_total
+            pool._wait_max = self._wait_max
+        return pool
+
+    def stats(self) -> dict:
+        """Returns the pool counters of this process"""
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_max": round(self._wait_max, 6),
+            }
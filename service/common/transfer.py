@@ -0,0 +1,345 @@
+"""
+Promotion Import and Export
+
+Moves promotion catalogs between environments as CSV or JSON Lines files in
+constant memory:
+
+- Exports stream the table in id order through a server-side cursor, CSV
+  exports from PostgreSQL are written by COPY ... TO STDOUT
+- Imports validate every row with Promotion.from_row, like POST
+  /promotions/bulk does, and load it in batches with Promotion.bulk_load
+  (COPY on PostgreSQL). Invalid rows and rows whose name is already taken
+  are reported with their row number and skipped. Empty CSV fields are
+  NULL, so an empty value or active flag takes its column default
+- After every batch the import writes a checkpoint with the byte offset it
+  reached, so an interrupted import resumes where it stopped, and rerunning
+  a batch that was loaded before the checkpoint was written skips its rows
+"""
+import csv
+import io
+import json
+import os
+import time
+import orjson
+from sqlalchemy import select
+from service.models import DataValidationError, Promotion, db
+
+FORMATS = ("csv", "jsonl")
+
+# the columns of an exported Promotion, in file order
+COLUMNS = ("id", "name", "product_id", "type", "value", "active", "start_date", "expiration_date")
+
+# accepted spellings of CSV booleans, including PostgreSQL COPY output
+TRUE_VALUES = ("true", "t", "1", "yes")
+FALSE_VALUES = ("false", "f", "0", "no")
+
+
+def file_format(path: str, requested: str = None) -> str:
+    """Returns the requested format or the one the file extension implies"""
+    if requested:
+        return requested
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson"):
+        return "jsonl"
+    if extension == "csv":
+        return "csv"
+    raise ValueError(f"Cannot tell the format of {path}, use --format {' or '.join(FORMATS)}")
+
+
+class Progress:
+    """
+    Counts rows and reports them with the throughput so far
+    """
+
+    def __init__(self, report=None):
+        self.report = report
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.errors = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Returns the rows counted per second since the start"""
+        return self.rows / max(time.perf_counter() - self.started, 1e-9)
+
+    def add(self, rows: int, errors: int = 0):
+        """Counts a batch and reports the totals"""
+        self.rows += rows
+        self.errors += errors
+        if self.report:
+            self.report(self)
+
+
+######################################################################
+#  E X P O R T
+######################################################################
+def export_promotions(file, fmt: str, batch_size: int, progress: Progress) -> int:
+    """
+    Writes every Promotion to a text file in id order
+
+    Args:
+        file: the open text file to write to
+        fmt (str): csv or jsonl
+        batch_size (int): rows fetched from the cursor at a time
+        progress (Progress): counts the rows written
+    Returns:
+        int: the number of Promotions written
+    """
+    if fmt == "csv" and db.engine.dialect.name == "postgresql":
+        return copy_export(file, batch_size, progress)
+    table = Promotion.__table__
+    statement = select(*[table.c[column] for column in COLUMNS]).order_by(table.c.id)
+    writer = csv.writer(file) if fmt == "csv" else None
+    if writer:
+        writer.writerow(COLUMNS)
+    # stream_results asks the driver for a server-side cursor where it has one
+    result = db.session.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+    for rows in result.partitions(batch_size):
+        for row in rows:
+            values = dict(zip(COLUMNS, row))
+            values["type"] = values["type"].name
+            values["start_date"] = values["start_date"].isoformat()
+            values["expiration_date"] = values["expiration_date"].isoformat()
+            if writer:
+                writer.writerow(values.values())
+            else:
+                file.write(orjson.dumps(values).decode() + "\n")
+        progress.add(len(rows))
+    return progress.rows
+
+
+class RecordCounter(io.TextIOBase):
+    """
+    Passes the CSV that COPY writes on to a file and reports every batch_size
+    records, counting the line ends that are not inside a quoted field
+    """
+
+    def __init__(self, file, batch_size: int, progress: Progress):
+        super().__init__()
+        self.file = file
+        self.batch_size = batch_size
+        self.progress = progress
+        self.quoted = False
+        # the header is the first record but not a Promotion
+        self.pending = -1
+
+    def write(self, data: str) -> int:
+        self.file.write(data)
+        # an escaped quote ("") flips the state twice, so only field quotes count
+        for index, part in enumerate(data.split('"')):
+            if index:
+                self.quoted = not self.quoted
+            if not self.quoted:
+                self.pending += part.count("\n")
+        if self.pending >= self.batch_size:
+            self.flush_progress()
+        return len(data)
+
+    def flush_progress(self):
+        """Reports the records written since the last report"""
+        if self.pending > 0:
+            self.progress.add(self.pending)
+            self.pending = 0
+
+
+def copy_export(file, batch_size: int, progress: Progress) -> int:
+    """Lets PostgreSQL write the CSV with COPY, in its own boolean and date formats"""
+    cursor = db.session.connection().connection.cursor()
+    # psycopg2 writes text rather than bytes to a TextIOBase
+    counter = RecordCounter(file, batch_size, progress)
+    cursor.copy_expert(
+        "COPY (SELECT {} FROM {} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)".format(
+            ", ".join(COLUMNS), Promotion.__tablename__
+        ),
+        counter,
+    )
+    counter.flush_progress()
+    return progress.rows
+
+
+######################################################################
+#  I M P O R T
+######################################################################
+class Checkpoint:
+    """
+    Where an import of a file got to, kept next to it as JSON
+    """
+
+    def __init__(self, path: str, source: str):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.size = os.path.getsize(source)
+        self.offset = 0
+        self.row = 0
+        self.rows = 0
+        self.errors = 0
+
+    def load(self) -> bool:
+        """Reads the checkpoint, returns False when there is none"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as file:
+            saved = json.load(file)
+        if saved["source"] != self.source or saved["size"] != self.size:
+            raise ValueError(f"Checkpoint {self.path} belongs to another file, remove it or use --restart")
+        self.offset, self.row, self.rows, self.errors = saved["offset"], saved["row"], saved["rows"], saved["errors"]
+        return True
+
+    def save(self, offset: int, row: int, rows: int, errors: int):
+        """Records progress, replacing the file at once so a crash never leaves half of it"""
+        self.offset, self.row, self.rows, self.errors = offset, row, rows, errors
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({
+                "source": self.source, "size": self.size, "offset": offset, "row": row,
+                "rows": rows, "errors": errors,
+            }, file)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        """Removes the checkpoint once the import is done"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class LineReader:
+    """
+    Decodes the lines of a binary file and counts the bytes handed out
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.offset = file.tell()
+
+    def __iter__(self):
+        for raw in self.file:
+            self.offset += len(raw)
+            yield raw.decode("utf-8")
+
+
+def parse_boolean(value):
+    """Parses a CSV boolean, an empty field is None"""
+    text = value.strip().lower()
+    if not text:
+        return None
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise DataValidationError(f"Invalid boolean: {value}")
+
+
+def parse_integer(name, value):
+    """Parses a CSV integer, an empty field is None"""
+    if not value.strip():
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise DataValidationError(f"{name} must be an integer: {value}")
+
+
+def csv_rows(lines, header):
+    """Yields each CSV record as a dict with the types deserialize expects"""
+    for record in csv.reader(lines):
+        if not record:
+            continue
+        if len(record) != len(header):
+            yield DataValidationError(f"Expected {len(header)} fields, found {len(record)}")
+            continue
+        row = dict(zip(header, record))
+        try:
+            for name in ("product_id", "value"):
+                if name in row:
+                    row[name] = parse_integer(name, row[name])
+            if "active" in row:
+                row["active"] = parse_boolean(row["active"])
+        except DataValidationError as error:
+            yield error
+            continue
+        yield row
+
+
+def jsonl_rows(lines):
+    """Yields each JSON line as a dict"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield DataValidationError(f"Invalid JSON: {error}")
+
+
+def validate(record) -> dict:
+    """Checks a record with the rules of POST /promotions/bulk and returns its column values"""
+    if isinstance(record, DataValidationError):
+        raise record
+    if not isinstance(record, dict):
+        raise DataValidationError("Invalid Promotion: row must be an object")
+    return Promotion.insert_values(Promotion.from_row(record))
+
+
+def import_promotions(path: str, fmt: str, batch_size: int, checkpoint: Checkpoint, progress: Progress,
+                      report_error=None) -> Progress:
+    """
+    Validates and loads the Promotions of a file, resuming from a checkpoint
+
+    Args:
+        path (str): the file to read
+        fmt (str): csv or jsonl
+        batch_size (int): rows loaded per transaction
+        checkpoint (Checkpoint): where the import resumes and records progress
+        progress (Progress): counts the rows loaded and rejected
+        report_error: called with the row number and message of every rejected row
+    """
+    with open(path, "rb") as file:
+        header = None
+        if fmt == "csv":
+            header = next(csv.reader([file.readline().decode("utf-8-sig")]))
+        if checkpoint.offset:
+            file.seek(checkpoint.offset)
+        progress.rows, progress.errors = checkpoint.rows, checkpoint.errors
+        lines = LineReader(file)
+        records = csv_rows(lines, header) if fmt == "csv" else jsonl_rows(lines)
+        number = checkpoint.row
+        batch = []
+        for number, record in enumerate(records, start=checkpoint.row + 1):
+            batch.append((number, record))
+            if len(batch) == batch_size:
+                load_batch(batch, progress, report_error)
+                checkpoint.save(lines.offset, number, progress.rows, progress.errors)
+                batch = []
+        if batch:
+            load_batch(batch, progress, report_error)
+            checkpoint.save(lines.offset, number, progress.rows, progress.errors)
+    return progress
+
+
+def load_batch(batch: list, progress: Progress, report_error=None):
+    """Validates a batch of (row number, record) pairs and loads the valid ones"""
+    valid = []
+    rejected = 0
+    names = set()
+    for number, record in batch:
+        try:
+            values = validate(record)
+            if values["name"] in names:
+                raise DataValidationError(f"Promotion with name {values['name']} is repeated in the file")
+        except DataValidationError as error:
+            rejected += 1
+            if report_error:
+                report_error(number, str(error))
+            continue
+        names.add(values["name"])
+        valid.append((number, values))
+    existing = Promotion.existing_names([values["name"] for _, values in valid])
+    rows = []
+    for number, values in valid:
+        if values["name"] in existing:
+            rejected += 1
+            if report_error:
+                report_error(number, f"Promotion with name {values['name']} already exists")
+            continue
+        rows.append(values)
+    progress.add(Promotion.bulk_load(rows), rejected)
@@ -12,5 +12,79 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Read replicas that take the SELECTs, comma separated, none by default
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()]
+# Seconds a replica whose connection failed is skipped
+REPLICA_EJECT_SECONDS = float(os.getenv("REPLICA_EJECT_SECONDS", "30"))
+# Seconds a client reads from the primary after it writes, to cover replica lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# Connection pool of each gunicorn worker, sized from the worker and thread
+# counts so all the workers together stay under the database's connection limit
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "1"))
+DATABASE_MAX_CONNECTIONS = int(os.getenv("DATABASE_MAX_CONNECTIONS", "100"))
+DATABASE_POOL_SIZE = int(os.getenv(
+    "DATABASE_POOL_SIZE", str(max(1, min(GUNICORN_THREADS, DATABASE_MAX_CONNECTIONS // WEB_CONCURRENCY)))
+))
+DATABASE_MAX_OVERFLOW = int(os.getenv(
+    "DATABASE_MAX_OVERFLOW",
+    str(max(0, min(DATABASE_POOL_SIZE, DATABASE_MAX_CONNECTIONS // WEB_CONCURRENCY - DATABASE_POOL_SIZE))),
+))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# connections each worker opens when it boots, before it takes requests
+DATABASE_POOL_WARM = int(os.getenv("DATABASE_POOL_WARM", str(DATABASE_POOL_SIZE)))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Pagination for the list endpoint
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Number of rows fetched per round-trip when streaming a listing
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Bulk create: rows per multi-row INSERT and the most rows in one request
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "100000"))
+# Largest bulk body once gzip is decompressed, kept well under the pod memory limit
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Per-worker cache of Promotion lookups by id and product id, 0 turns it off
+PROMOTION_CACHE_SIZE = int(os.getenv("PROMOTION_CACHE_SIZE", "10000"))
+PROMOTION_CACHE_TTL = float(os.getenv("PROMOTION_CACHE_TTL", "30"))
+# Most Promotions of one product the cache holds, larger products are read page by page
+PROMOTION_CACHE_PRODUCT_ROWS = int(os.getenv("PROMOTION_CACHE_PRODUCT_ROWS", "500"))
+
+# Most product ids accepted by one batch lookup
+LOOKUP_MAX_PRODUCTS = int(os.getenv("LOOKUP_MAX_PRODUCTS", "500"))
+
+# Most cart lines accepted by one pricing request
+PRICE_MAX_LINES = int(os.getenv("PRICE_MAX_LINES", "200000"))
+
+# Most timestamps checked by one availability request
+AVAILABLE_MAX_TIMESTAMPS = int(os.getenv("AVAILABLE_MAX_TIMESTAMPS", "200000"))
+
+# Unit price used to rank Promotions of different types against each other
+BEST_REFERENCE_PRICE = float(os.getenv("BEST_REFERENCE_PRICE", "100"))
+
+# Compression of dynamic responses, buffered responses smaller than
+# COMPRESS_MIN_SIZE bytes are sent as they are
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Seconds browsers may cache the content-hashed assets built by flask build-static
+ASSET_MAX_AGE = int(os.getenv("ASSET_MAX_AGE", "31536000"))
+
+# Per-request SQL instrumentation: statements slower than SQL_SLOW_QUERY_MS are
+# logged, a statement run SQL_REPEAT_THRESHOLD times in one request is flagged
+# as a likely N+1, and the Server-Timing and X-DB-Queries headers are sent in
+# debug mode or when SQL_TIMING_HEADERS is on
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "5"))
+SQL_TIMING_HEADERS = os.getenv("SQL_TIMING_HEADERS", "false").lower() in ("1", "true", "yes")
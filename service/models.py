@@ -14,22 +14,165 @@ Promotion - A Promotion used in the eCommerce website
 
 All of the models are stored in this module
 """
+import csv
+import io
 import logging
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import any_, bindparam, false, func, inspect, select, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.schema import CreateColumn
 from enum import Enum
 from datetime import datetime, date, timedelta
 import dateutil.parser
+import orjson
+from service.common.interval_index import IntervalIndex
+from service.common.replicas import RoutingSQLAlchemy
+from service.common.timed_pool import TimedQueuePool
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
 
 
+class DataConflictError(Exception):
+    """ Used when a Promotion was changed by someone else while updating it """
+
+
+def parse_date(value):
+    """Parses a date query argument into a naive datetime like the stored dates"""
+    if isinstance(value, (datetime, date)):
+        return value
+    if not isinstance(value, str):
+        raise DataValidationError("Invalid date: " + str(value))
+    try:
+        parsed = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise DataValidationError("Invalid date: " + str(value))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def read_integer(name: str, value, nullable: bool = False):
+    """Checks an Integer field of a request, JSON booleans are not Integers"""
+    if value is None and nullable:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise DataValidationError(f"{name} must be an Integer")
+    return value
+
+
+def read_boolean(name: str, value, nullable: bool = False):
+    """Checks a Boolean field of a request"""
+    if value is None and nullable:
+        return None
+    if not isinstance(value, bool):
+        raise DataValidationError(f"{name} must be a Boolean")
+    return value
+
+
+def read_type(value):
+    """Reads a PromotionType from its name"""
+    if not isinstance(value, str) or value not in PromotionType.__members__:
+        raise DataValidationError("Unknown promotion type: " + str(value))
+    return PromotionType[value]
+
+
+def read_date(name: str, value):
+    """Reads an ISO date field of a request, an empty date is None"""
+    if value is None or value == "" or isinstance(value, datetime):
+        return value or None
+    if not isinstance(value, str):
+        raise DataValidationError(f"{name} must be an ISO date string, e.g. 2021-01-01")
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise DataValidationError("Must be ISO format, e.g. 2021-01-01")
+
+
+class LookupCache:
+    """
+    Bounded least recently used cache whose entries expire after a time to live
+
+    Each process has its own cache, so the time to live bounds how long a
+    change made through another worker can go unseen
+    """
+
+    def __init__(self, maxsize: int = 0, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, maxsize: int, ttl: float):
+        """ Resizes the cache, a size of 0 turns it off """
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key):
+        """ Returns the cached value for a key or None """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """ Caches a value, evicting the least recently used entry when full """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """ Removes the entries for the given keys """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """ Returns the size and the hit, miss and eviction counters """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
 class PromotionType(Enum):
     """Enumeration of valid Promotion Types"""
     BOGO = 1 #Buy one get one free
@@ -43,6 +186,10 @@ class Promotion(db.Model):
     """
 
     app = None
+    # caches column values by ("id", id) and ("product_id", product_id), and
+    # the availability index and best Promotion stack of a product by
+    # ("available", product_id) and ("best", product_id)
+    cache = LookupCache()
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
@@ -53,25 +200,228 @@ class Promotion(db.Model):
     active = db.Column(db.Boolean(), nullable=False, default=False)
     start_date = db.Column(db.DateTime(), nullable=False)
     expiration_date = db.Column(db.DateTime(), nullable=False)
+    # bumped on every write, used for ETags and optimistic concurrency
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(
+        db.DateTime(), nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+        server_default=func.now(),
+    )
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # Indexes for every query path, apply new ones to a live database with: flask db-migrate
+    __table_args__ = (
+        db.Index("ix_promotion_product_active_dates", product_id, active, start_date, expiration_date),
+        db.Index(
+            "ix_promotion_active_dates", product_id, start_date, expiration_date,
+            postgresql_where=active.is_(True), sqlite_where=active.is_(True),
+        ),
+        db.Index("ix_promotion_name", name, unique=True),
+    )
 
     def __repr__(self):
         return "<Promotion %r id=[%s]>" % (self.name, self.id)
 
-    def create(self):
+    def create(self, upsert: bool = False) -> bool:
         """
         Creates a Promotion to the database
+        The row is written with one INSERT ... ON CONFLICT statement on the
+        unique name, so no query has to check for the name first and two
+        requests racing for a name cannot both win
+
+        Args:
+            upsert (bool): overwrite a Promotion with the same name instead of
+                raising DataConflictError
+
+        Returns:
+            bool: True if a new Promotion was inserted, False if one was overwritten
+        """
+        self.validate_create()
+        logger.info("Creating %s", self.name)
+        values = dict(self.insert_values(self), updated_at=datetime.utcnow())
+        statement = self._insert_statement(values, upsert)
+        try:
+            row = self._execute_insert(statement, upsert)
+            if row is None:
+                raise DataConflictError(f"Promotion with name '{self.name}' already exists")
+            db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            if self.name_taken(error):
+                raise DataConflictError(f"Promotion with name '{self.name}' already exists") from error
+            raise
+        except Exception:
+            db.session.rollback()
+            raise
+
+        # the row holds the column defaults too, so the instance must match it
+        for column, value in values.items():
+            setattr(self, column, value)
+        self.id, self.version = row
+        self._attach()
+        created = self.version == 1
+        if created:
+            self.cache.invalidate(*self._product_keys(self.product_id))
+        else:
+            # the overwritten row may have belonged to another product
+            self.cache.clear()
+        return created
+
+    @classmethod
+    def insert_values(cls, source) -> dict:
+        """
+        Returns the INSERT_COLUMNS values of a Promotion or row mapping
+        Unset columns get their column default, an INSERT that names a column
+        with None would store NULL instead
+        """
+        read = source.get if isinstance(source, dict) else lambda column: getattr(source, column)
+        values = {}
+        for column in cls.INSERT_COLUMNS:
+            value = read(column)
+            default = cls.__table__.c[column].default
+            if value is None and default is not None and default.is_scalar:
+                value = default.arg
+            values[column] = value
+        return values
+
+    def _insert_statement(self, values: dict, upsert: bool):
+        """ Builds the INSERT of a new Promotion, ON CONFLICT on the name where the dialect has it """
+        table = self.__table__
+        insert = self.DIALECT_INSERTS.get(db.engine.dialect.name)
+        if insert is None:
+            if upsert:
+                raise DataValidationError(f"Upsert is not supported on {db.engine.dialect.name}")
+            return table.insert().values(version=1, **values)
+        if upsert:
+            return insert(table).values(version=1, **values).on_conflict_do_update(
+                index_elements=[table.c.name], set_=dict(values, version=table.c.version + 1)
+            )
+        return insert(table).values(version=1, **values).on_conflict_do_nothing(index_elements=[table.c.name])
+
+    def _execute_insert(self, statement, upsert: bool):
+        """ Runs an insert statement and returns the (id, version) written, None if nothing was """
+        table = self.__table__
+        if db.engine.dialect.full_returning:
+            return db.session.execute(statement.returning(table.c.id, table.c.version)).first()
+        result = db.session.execute(statement)
+        if not result.rowcount:
+            return None
+        if upsert:
+            return db.session.query(Promotion.id, Promotion.version).filter(Promotion.name == self.name).first()
+        return (result.inserted_primary_key[0], 1)
+
+    @staticmethod
+    def name_taken(error: IntegrityError) -> bool:
+        """ Tells whether an IntegrityError is a unique violation on the Promotion name """
+        # psycopg2 names the violated constraint, sqlite only says it in the message
+        constraint = getattr(getattr(error.orig, "diag", None), "constraint_name", None)
+        if constraint:
+            return constraint == "ix_promotion_name"
+        return "UNIQUE constraint failed: promotion.name" in str(error.orig)
+
+    def _attach(self):
+        """ Adds a Promotion written without the ORM to the session as a clean row """
+        state = inspect(self)
+        if state.transient:
+            make_transient_to_detached(self)
+        if state.detached:
+            # an upsert may have overwritten a row this session already holds
+            loaded = db.session.identity_map.get(state.key)
+            if loaded is not None:
+                db.session.expire(loaded)
+            else:
+                db.session.add(self)
+
+    def validate_create(self):
+        """
+        Checks a new Promotion and fills in the default dates
         """
         if self.product_id is None:
             raise DataValidationError("Product Id cannot be empty")
 
         if self.start_date is None and self.expiration_date is None:
-            self.start_date = date.today()
-            self.expiration_date = (date.today() + timedelta(days=9))
+            self.start_date = datetime.combine(date.today(), datetime.min.time())
+            self.expiration_date = self.start_date + timedelta(days=9)
+        elif self.start_date is None or self.expiration_date is None:
+            raise DataValidationError("start_date and expiration_date must both be given or both be left out")
 
-        self.id = None  # id must be none to generate next primary key
-        logger.info("Creating %s", self.name)
-        db.session.add(self)
-        db.session.commit()
+    @classmethod
+    def bulk_create(cls, promotions: list, chunk_size: int) -> list:
+        """
+        Creates many validated Promotions in a single transaction
+        Each chunk is written with one multi-row INSERT ... RETURNING,
+        databases without RETURNING read the new ids back by name
+        """
+        logger.info("Bulk creating %d Promotions", len(promotions))
+        table = cls.__table__
+        updated_at = datetime.utcnow()
+        try:
+            for start in range(0, len(promotions), chunk_size):
+                chunk = promotions[start:start + chunk_size]
+                rows = [
+                    dict(cls.insert_values(promotion), version=1, updated_at=updated_at)
+                    for promotion in chunk
+                ]
+                # names are unique so they map the new ids back to their rows
+                if db.engine.dialect.full_returning:
+                    result = db.session.execute(table.insert().values(rows).returning(table.c.id, table.c.name))
+                else:
+                    db.session.execute(table.insert().values(rows))
+                    names = [promotion.name for promotion in chunk]
+                    result = db.session.query(cls.id, cls.name).filter(cls.name.in_(names))
+                ids = {name: id for id, name in result}
+                for promotion in chunk:
+                    promotion.id = ids[promotion.name]
+                    promotion.version = 1
+                    promotion.updated_at = updated_at
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for product_id in {promotion.product_id for promotion in promotions}:
+            cls.cache.invalidate(*cls._product_keys(product_id))
+        return promotions
+
+    @classmethod
+    def bulk_load(cls, rows: list) -> int:
+        """
+        Loads a batch of rows of INSERT_COLUMNS values in one transaction
+        PostgreSQL reads them with COPY, other databases with a batched INSERT.
+        The rows are not validated and their ids are not read back
+        Returns the number of rows loaded
+        """
+        if not rows:
+            return 0
+        logger.info("Loading %d Promotions", len(rows))
+        rows = [cls.insert_values(row) for row in rows]
+        columns = cls.INSERT_COLUMNS + ("version", "updated_at")
+        updated_at = datetime.utcnow()
+        try:
+            if db.engine.dialect.name == "postgresql":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow([
+                        row["name"], row["product_id"], row["type"].name, row["value"], row["active"],
+                        row["start_date"].isoformat(), row["expiration_date"].isoformat(), 1, updated_at.isoformat(),
+                    ])
+                buffer.seek(0)
+                cursor = db.session.connection().connection.cursor()
+                cursor.copy_expert(
+                    "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(cls.__tablename__, ", ".join(columns)), buffer
+                )
+            else:
+                db.session.execute(
+                    cls.__table__.insert(),
+                    [dict(row, version=1, updated_at=updated_at) for row in rows],
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for product_id in {row["product_id"] for row in rows}:
+            cls.cache.invalidate(*cls._product_keys(product_id))
+        return len(rows)
 
     def update(self):
         """
@@ -85,13 +435,59 @@ class Promotion(db.Model):
             raise DataValidationError("Product Id is not valid")
 
         logger.info("Saving %s", self.name)
-        db.session.commit()
+        self._fill_defaults()
+        # the product id may be changing, so drop the old product's entry too
+        product_ids = set(inspect(self).attrs.product_id.history.deleted)
+        product_ids.add(self.product_id)
+        promotion_id = self.id
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            self.cache.invalidate(("id", promotion_id))
+            raise DataConflictError(f"Promotion with id '{promotion_id}' was changed by another request")
+        except IntegrityError as error:
+            db.session.rollback()
+            if self.name_taken(error):
+                raise DataConflictError(f"Promotion with name '{self.name}' already exists") from error
+            raise DataValidationError(f"Invalid Promotion: {error.orig}") from error
+        except Exception:
+            db.session.rollback()
+            raise
+        self.cache.invalidate(("id", promotion_id))
+        for product_id in product_ids:
+            self.cache.invalidate(*self._product_keys(product_id))
+
+    def _fill_defaults(self):
+        """ Gives a null value or active flag its column default, like create does """
+        for column, value in self.insert_values(self).items():
+            if value is not None and getattr(self, column) is None:
+                setattr(self, column, value)
 
     def delete(self):
         """ Removes a Promotion from the data store """
         logger.info("Deleting %s", self.name)
-        db.session.delete(self)
-        db.session.commit()
+        promotion_id, product_id = self.id, self.product_id
+        try:
+            db.session.delete(self)
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            self.cache.invalidate(("id", promotion_id))
+            raise DataConflictError(f"Promotion with id '{promotion_id}' was changed by another request")
+        except Exception:
+            db.session.rollback()
+            raise
+        self.cache.invalidate(("id", promotion_id), *self._product_keys(product_id))
+
+    @staticmethod
+    def _product_keys(product_id) -> tuple:
+        """ Returns the cache keys that depend on the Promotions of a product """
+        return ("product_id", product_id), ("available", product_id), ("best", product_id)
+
+    def _column_values(self) -> dict:
+        """ Returns the column values of a Promotion for caching """
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
 
     def serialize(self):
         """ Serializes a Promotion into a dictionary """
@@ -106,6 +502,28 @@ class Promotion(db.Model):
             "expiration_date": self.expiration_date.isoformat(),
         }
 
+    def to_json(self) -> bytes:
+        """ Serializes a Promotion straight to JSON in one pass """
+        return orjson.dumps(self._json_fields())
+
+    @staticmethod
+    def list_to_json(promotions) -> bytes:
+        """ Serializes many Promotions straight to a JSON array in one pass """
+        return orjson.dumps([promotion._json_fields() for promotion in promotions])
+
+    def _json_fields(self) -> dict:
+        """ Returns the fields of serialize() with the dates left for orjson to encode """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "product_id": self.product_id,
+            "type": self.type.name,
+            "value": self.value,
+            "active": self.active,
+            "start_date": self.start_date,
+            "expiration_date": self.expiration_date,
+        }
+
     def deserialize(self, data):
         """
         Deserializes a Promotion from a dictionary
@@ -113,63 +531,224 @@ class Promotion(db.Model):
         Args:
             data (dict): A dictionary containing the resource data
         """
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid Promotion: body of request contained bad or no data")
         try:
-            # self.id = data["id"]
-            self.product_id = data["product_id"]
-            # check if product id is Integer
-            if self.product_id is None or not isinstance(self.product_id, int):
-                raise DataValidationError("Product Id must be an Integer")
-
+            self.product_id = read_integer("product_id", data["product_id"])
             self.name = data["name"]
             if not isinstance(self.name, str):
-                raise DataValidationError("Promotion name must be an Integer")
-            self.type = getattr(PromotionType, data["type"])
-            self.value = data["value"]
-            self.active = data["active"]
-             # convert str to datetime
-            if data["start_date"] and isinstance(data["start_date"], str):
-                try:
-                    self.start_date = datetime.fromisoformat(data["start_date"])
-                except ValueError:
-                    raise DataValidationError("Must be ISO format, e.g. 2021-01-01")
-            else:
-                self.start_date = data["start_date"]
-
-            if data["expiration_date"] and isinstance(data["expiration_date"], str):
-                try:
-                    self.expiration_date = datetime.fromisoformat(data["expiration_date"])
-                except ValueError:
-                    raise DataValidationError("Must be ISO format, e.g. 2021-01-01") 
-            else:
-                self.expiration_date = data["expiration_date"]
-
-        except AttributeError as error:
-            raise DataValidationError("Invalid attribute: " + error.args[0])
-
+                raise DataValidationError("Promotion name must be a String")
+            self.type = read_type(data["type"])
+            # unset values and active flags take the column defaults
+            self.value = read_integer("value", data["value"], nullable=True)
+            self.active = read_boolean("active", data["active"], nullable=True)
+            self.start_date = read_date("start_date", data["start_date"])
+            self.expiration_date = read_date("expiration_date", data["expiration_date"])
         except KeyError as error:
             raise DataValidationError(
                 "Invalid Promotion: missing " + error.args[0]
             )
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid Promotion: body of request contained bad or no data - "
-                "Error message: " + error
-            )
-        
         return self
-    
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Deserializes and validates a new Promotion from a bulk request or import row
+
+        Args:
+            row (dict): A dictionary containing the resource data
+        """
+        promotion = cls().deserialize(row)
+        if promotion.type == PromotionType.BOGO:
+            promotion.value = 0
+        promotion.validate_create()
+        return promotion
+
+    @classmethod
+    def deserialize_partial(cls, data) -> dict:
+        """
+        Deserializes the fields of a partial update into column values
+
+        Args:
+            data (dict): A dictionary containing only the fields to change
+        """
+        if not isinstance(data, dict) or not data:
+            raise DataValidationError("Invalid patch: body must be a JSON object of fields to change")
+        values = {}
+        for key, value in data.items():
+            if key not in cls.PATCH_FIELDS:
+                # ids and names are unique so they can only change one Promotion at a time
+                raise DataValidationError("Invalid patch: cannot change " + key)
+            try:
+                values[key] = cls.PATCH_FIELDS[key](key, value)
+            except DataValidationError as error:
+                raise DataValidationError(f"Invalid patch: {error}")
+            if values[key] is None:
+                raise DataValidationError(f"Invalid patch: {key} cannot be empty")
+        return values
+
+    def unit_discount(self, unit_price: float) -> float:
+        """
+        Returns the discount on one unit at a price, counting BOGO as half off
+
+        Args:
+            unit_price (float): the price of one unit
+        """
+        value = self.value or 0
+        if self.type == PromotionType.BOGO:
+            return unit_price / 2
+        if self.type == PromotionType.PERCENTAGE:
+            return unit_price * min(max(value, 0), 100) / 100
+        return min(max(value, 0), unit_price)
+
     def is_available(self):
         return self.start_date <= date.today() and self.expiration_date >= date.today()
 
     @classmethod
     def init_db(cls, app):
-        """ Initializes the database session """
+        """ Initializes the database session, the first query opens the connection """
         logger.info("Initializing database")
         cls.app = app
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", cls.engine_options(app.config))
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        cls.cache.configure(app.config["PROMOTION_CACHE_SIZE"], app.config["PROMOTION_CACHE_TTL"])
+        replica_uris = app.config["DATABASE_REPLICA_URIS"]
+        db.replicas.configure(
+            replica_uris,
+            cls.engine_options(app.config, replica_uris[0]) if replica_uris else {},
+            app.config["REPLICA_EJECT_SECONDS"],
+        )
+
+    @staticmethod
+    def engine_options(config, database_uri: str = None) -> dict:
+        """ Returns the connection pool options for the configured database or database_uri """
+        if (database_uri or config["SQLALCHEMY_DATABASE_URI"]).startswith("sqlite"):
+            # SQLite connections are files or memory, there is nothing to pool
+            return {}
+        return {
+            "poolclass": TimedQueuePool,
+            "pool_size": config["DATABASE_POOL_SIZE"],
+            "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+            "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+            "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+            "pool_pre_ping": config["DATABASE_POOL_PRE_PING"],
+        }
+
+    @classmethod
+    def warm_pool(cls, size: int = None) -> int:
+        """ Opens pooled connections up front so a new worker does not connect on its first requests """
+        size = cls.app.config["DATABASE_POOL_WARM"] if size is None else size
+        connections = []
+        try:
+            for _ in range(size):
+                connections.append(db.engine.connect())
+        finally:
+            for connection in connections:
+                connection.close()
+        logger.info("Warmed %d database connections", len(connections))
+        return len(connections)
+
+    @staticmethod
+    def pool_stats() -> dict:
+        """ Returns the connection pool counters of this process """
+        pool = db.engine.pool
+        if isinstance(pool, TimedQueuePool):
+            return pool.stats()
+        return {"class": type(pool).__name__, "status": pool.status()}
+
+    @classmethod
+    def migrate(cls):
+        """ Adds any missing table, columns and indexes without dropping or locking the table """
+        engine = db.engine
+        concurrently = engine.dialect.name == "postgresql"
+        # the table and its columns change in one transaction, so a failure leaves no half migrated schema
+        with engine.begin() as connection:
+            if engine.dialect.name == "sqlite":
+                # pysqlite only opens a transaction before DML, so DDL would commit statement by statement
+                connection.exec_driver_sql("BEGIN")
+            cls.__table__.create(connection, checkfirst=True)
+            changes = cls._add_columns(connection)
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            inspector = inspect(connection)
+            indexes = {index["name"] for index in inspector.get_indexes(cls.__tablename__)}
+            invalid = cls._invalid_indexes(connection)
+            for index in sorted(cls.__table__.indexes, key=lambda index: index.name):
+                if index.name in indexes and index.name not in invalid:
+                    continue
+                if index.unique:
+                    cls._check_unique(connection, index)
+                if index.name in invalid:
+                    # a concurrent build that failed leaves an index that is never used
+                    logger.warning("Dropping invalid index %s", index.name)
+                    connection.execute(text("DROP INDEX CONCURRENTLY IF EXISTS {}".format(index.name)))
+                    changes.append(f"Dropped invalid index {index.name}")
+                logger.info("Creating index %s", index.name)
+                index.dialect_options["postgresql"]["concurrently"] = concurrently
+                try:
+                    index.create(connection)
+                finally:
+                    index.dialect_options["postgresql"]["concurrently"] = False
+                changes.append(f"Created index {index.name}")
+        return changes
+
+    @classmethod
+    def _add_columns(cls, connection) -> list:
+        """ Adds the columns the table is missing, filling them in for the existing rows """
+        table, dialect = cls.__table__, connection.dialect
+        existing = {column["name"] for column in inspect(connection).get_columns(cls.__tablename__)}
+        changes = []
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            logger.info("Adding column %s", column.name)
+            default = column.server_default
+            if default is None or isinstance(default.arg, str):
+                # a constant server default fills in the existing rows itself
+                definition = CreateColumn(column).compile(dialect=dialect)
+                connection.execute(text(f"ALTER TABLE {cls.__tablename__} ADD COLUMN {definition}"))
+                changes.append(f"Added column {column.name}")
+                continue
+            # SQLite cannot add a column whose default is an expression, so it is
+            # added nullable and the existing rows are filled in with an UPDATE
+            bare = db.Column(column.name, column.type)
+            connection.execute(text("ALTER TABLE {} ADD COLUMN {}".format(
+                cls.__tablename__, CreateColumn(bare).compile(dialect=dialect)
+            )))
+            connection.execute(table.update().values({column.name: default.arg}))
+            if dialect.name == "postgresql":
+                alter = f"ALTER TABLE {cls.__tablename__} ALTER COLUMN {column.name}"
+                connection.execute(text(f"{alter} SET DEFAULT {default.arg.compile(dialect=dialect)}"))
+                if not column.nullable:
+                    connection.execute(text(f"{alter} SET NOT NULL"))
+            changes.append(f"Added column {column.name}")
+        return changes
+
+    @classmethod
+    def _invalid_indexes(cls, connection) -> set:
+        """ Returns the names of the indexes PostgreSQL marked invalid after a failed build """
+        if connection.dialect.name != "postgresql":
+            return set()
+        return set(connection.execute(text(
+            "SELECT pg_class.relname FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+            "WHERE pg_index.indrelid = to_regclass(:table) AND NOT pg_index.indisvalid"
+        ), {"table": cls.__tablename__}).scalars())
+
+    @classmethod
+    def _check_unique(cls, connection, index):
+        """ Refuses to build a unique index over rows that would violate it """
+        columns = list(index.columns)
+        duplicates = connection.execute(
+            select(*columns, func.count()).where(*[column.isnot(None) for column in columns])
+            .group_by(*columns).having(func.count() > 1).limit(5)
+        ).all()
+        if duplicates:
+            examples = ", ".join("{} ({} rows)".format("/".join(map(str, row[:-1])), row[-1]) for row in duplicates)
+            raise DataValidationError(
+                f"Cannot create unique index {index.name}, these values are used more than once: {examples}. "
+                "Rename or remove the duplicates and run flask db-migrate again"
+            )
 
     @classmethod
     def all(cls):
@@ -181,10 +760,185 @@ class Promotion(db.Model):
     def find(cls, promotion_id):
         """ Finds a Promotion by it's ID """
         logger.info("in find(): Processing lookup for id %s ...", promotion_id)
-        # active_promotions = cls.query.filter(cls.id == promotion_id)
-        # return active_promotions[0]
-        return cls.query.get(promotion_id)
+        try:
+            promotion_id = int(promotion_id)
+        except (TypeError, ValueError):
+            return None
+        values = cls.cache.get(("id", promotion_id))
+        if values is None:
+            promotion = cls.query.get(promotion_id)
+            if promotion is not None:
+                cls.cache.set(("id", promotion_id), promotion._column_values())
+            return promotion
+        # attach the cached row to the session without a SELECT so it can be updated
+        promotion = cls(**values)
+        make_transient_to_detached(promotion)
+        return db.session.merge(promotion, load=False)
+
+    @classmethod
+    def find_current(cls, promotion_id):
+        """ Finds a Promotion by it's ID in the database, never in the cache
+        Writes start from the row this returns so they act on its current version
+        """
+        logger.info("in find_current(): Processing lookup for id %s ...", promotion_id)
+        try:
+            promotion_id = int(promotion_id)
+        except (TypeError, ValueError):
+            return None
+        promotion = db.session.get(cls, promotion_id, populate_existing=True)
+        if promotion is None:
+            cls.cache.invalidate(("id", promotion_id))
+        return promotion
+
+    @classmethod
+    def find_by_product_id_cached(cls, product_id: int):
+        """Returns all Promotions with product_id: product_id ordered by id
+        The Promotions come from the lookup cache when possible and are
+        read-only copies that are not attached to the session. A product with
+        more than PROMOTION_CACHE_PRODUCT_ROWS Promotions is not cached and
+        None is returned, so callers query the database a page at a time
+        """
+        logger.info("Processing cached product_id query for %s ...", product_id)
+        rows = cls.cache.get(("product_id", product_id))
+        if rows is None:
+            most = cls.app.config["PROMOTION_CACHE_PRODUCT_ROWS"]
+            promotions = cls.find_by_product_id(product_id).order_by(cls.id).limit(most + 1).all()
+            # False remembers that the product is too large without holding its rows
+            rows = tuple(promotion._column_values() for promotion in promotions) if len(promotions) <= most else False
+            cls.cache.set(("product_id", product_id), rows)
+        if rows is False:
+            return None
+        return [cls(**values) for values in rows]
+
+    @classmethod
+    def _find_active_at(cls, product_id: int, at: datetime) -> list:
+        """Returns the active Promotions of a product available at a time, from the database"""
+        return cls.find_by_product_id(product_id).filter(
+            cls.active.is_(True), cls.start_date <= at, cls.expiration_date >= at
+        ).order_by(cls.start_date, cls.id).all()
     
+    @classmethod
+    def find_available(cls, product_id: int, at: datetime = None) -> list:
+        """Returns the active Promotions of a product that are available at a time
+        Only active Promotions count, like in find_best() and cart pricing.
+        Each product's availability windows are indexed in memory, the index
+        is rebuilt only after that product's Promotions change or expire
+        from the cache
+        :param product_id: the product to look up
+        :param at: the time to check, defaults to now
+        :return: read-only copies of the available Promotions ordered by start date
+        :rtype: list
+        """
+        logger.info("Processing available query for product %s at %s ...", product_id, at)
+        at = at or datetime.now()
+        index = cls.cache.get(("available", product_id))
+        if index is None:
+            promotions = cls.find_by_product_id_cached(product_id)
+            if promotions is None:
+                return cls._find_active_at(product_id, at)
+            index = IntervalIndex(
+                (promotion.start_date, promotion.expiration_date, promotion)
+                for promotion in promotions if promotion.active
+            )
+            cls.cache.set(("available", product_id), index)
+        return index.containing(at)
+
+    @classmethod
+    def find_best(cls, product_id: int, at: datetime = None, unit_price: float = None):
+        """Returns the best Promotion that applies to a product at a time
+        The active Promotions of each product are kept in a stack ranked by
+        their discount on one unit at the reference price, then by the soonest
+        expiration, so the hot path only walks to the first available one
+        :param product_id: the product to look up
+        :param at: the time to check, defaults to now
+        :param unit_price: rank for this unit price instead of the reference price
+        :return: a read-only copy of the best Promotion or None
+        """
+        logger.info("Processing best query for product %s at %s ...", product_id, at)
+        at = at or datetime.now()
+        stack = cls.cache.get(("best", product_id))
+        if stack is None:
+            promotions = cls.find_by_product_id_cached(product_id)
+            if promotions is None:
+                # too many to cache, so rank only the ones available now
+                if unit_price is None:
+                    unit_price = cls.app.config["BEST_REFERENCE_PRICE"]
+                ranked = cls._rank(cls._find_active_at(product_id, at), unit_price)
+                return ranked[0] if ranked else None
+            stack = cls._rank(
+                [promotion for promotion in promotions if promotion.active], cls.app.config["BEST_REFERENCE_PRICE"]
+            )
+            cls.cache.set(("best", product_id), stack)
+        if unit_price is not None:
+            stack = cls._rank(stack, unit_price)
+        for promotion in stack:
+            if promotion.start_date <= at <= promotion.expiration_date:
+                return promotion
+        return None
+
+    @staticmethod
+    def _rank(promotions, unit_price) -> tuple:
+        """Orders Promotions by their discount at a unit price, then by expiration"""
+        return tuple(sorted(
+            promotions,
+            key=lambda promotion: (-promotion.unit_discount(unit_price), promotion.expiration_date, promotion.id),
+        ))
+
+    @classmethod
+    def find_by_product_ids(cls, product_ids: list, available_at: datetime = None, active: bool = None) -> dict:
+        """Returns the Promotions of many products with a single query
+        :param product_ids: the products to look up
+        :param available_at: only return Promotions available at this time
+        :param active: only return Promotions with this active status
+        :return: a map of every product id to its Promotions ordered by id
+        :rtype: dict
+        """
+        logger.info("Processing product_ids query for %d products ...", len(product_ids))
+        product_ids = list(dict.fromkeys(product_ids))
+        found = {product_id: [] for product_id in product_ids}
+        for query in cls._product_ids_queries(cls.query, product_ids, available_at, active):
+            for promotion in query.order_by(cls.product_id, cls.id):
+                found[promotion.product_id].append(promotion)
+        return found
+
+    @classmethod
+    def find_pricing_terms(cls, product_ids: list, available_at: datetime) -> list:
+        """Returns the terms of the active Promotions of many products
+        Only the columns pricing needs are read, without building Promotions
+        :param product_ids: the products to look up
+        :param available_at: only return Promotions available at this time
+        :return: (id, product_id, PromotionType value, value) tuples
+        :rtype: list
+        """
+        logger.info("Processing pricing terms query for %d products ...", len(product_ids))
+        product_ids = list(dict.fromkeys(product_ids))
+        columns = db.session.query(cls.id, cls.product_id, cls.type, cls.value)
+        return [
+            (id, product_id, type.value, value or 0)
+            for query in cls._product_ids_queries(columns, product_ids, available_at, True)
+            for id, product_id, type, value in query
+        ]
+
+    @classmethod
+    def _product_ids_queries(cls, query, product_ids, available_at, active):
+        """Yields the queries that together match the Promotions of many products"""
+        if db.engine.dialect.name == "postgresql":
+            # one array parameter keeps the statement the same for any number of ids
+            predicates = [cls.product_id == any_(bindparam("product_ids", product_ids, type_=ARRAY(db.Integer)))]
+        else:
+            # other databases limit the number of bound parameters in one statement
+            predicates = [
+                cls.product_id.in_(product_ids[start:start + cls.IN_CHUNK_SIZE])
+                for start in range(0, len(product_ids), cls.IN_CHUNK_SIZE)
+            ]
+        for predicate in predicates:
+            chunk = query.filter(predicate)
+            if available_at is not None:
+                chunk = chunk.filter(cls.start_date <= available_at, cls.expiration_date >= available_at)
+            if active is not None:
+                chunk = chunk.filter(cls.active == active)
+            yield chunk
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all Promotions with the given name
@@ -192,8 +946,57 @@ class Promotion(db.Model):
             name (string): the name of the Promotions you want to match
         """
         logger.info("Processing name query for %s ...", name)
-        if isinstance(name, str):
-            return cls.query.filter(cls.name == name).all()
+        if not isinstance(name, str):
+            return cls.query.filter(false())
+        return cls.query.filter(cls.name == name)
+
+    @classmethod
+    def bulk_update(cls, query, values: dict) -> int:
+        """
+        Updates every Promotion matched by a query with one UPDATE statement
+        Returns the number of Promotions updated
+        """
+        logger.info("Bulk updating Promotions with %s", values)
+        values = dict(values, version=cls.version + 1, updated_at=datetime.utcnow())
+        try:
+            count = query.update(values, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # the rows that changed are not known without reading them back
+        cls.cache.clear()
+        return count
+
+    @classmethod
+    def bulk_delete(cls, query) -> int:
+        """
+        Deletes every Promotion matched by a query with one DELETE statement
+        Returns the number of Promotions deleted
+        """
+        logger.info("Bulk deleting Promotions")
+        try:
+            count = query.delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cls.cache.clear()
+        return count
+
+    @classmethod
+    def existing_names(cls, names: list, chunk_size: int = 1000) -> set:
+        """Returns which of the given names are already used by a Promotion
+        Args:
+            names (list): the names to check
+            chunk_size (int): the most names sent in one IN (...) query
+        """
+        logger.info("Processing existing names query for %d names ...", len(names))
+        existing = set()
+        for start in range(0, len(names), chunk_size):
+            chunk = names[start:start + chunk_size]
+            existing.update(name for (name,) in db.session.query(cls.name).filter(cls.name.in_(chunk)))
+        return existing
 
     @classmethod
     def find_by_type(cls, type):
@@ -203,7 +1006,7 @@ class Promotion(db.Model):
         """
         logger.info("Processing type query for %s ...", type)
 
-        return cls.query.filter(cls.type == type).all()
+        return cls.query.filter(cls.type == type)
 
     @classmethod
     def find_by_value(cls, value):
@@ -212,7 +1015,7 @@ class Promotion(db.Model):
             value (Integer): the type of the Promotions you want to match
         """
         logger.info("Processing value query for %s ...", value)
-        return cls.query.filter(cls.value == value).all()
+        return cls.query.filter(cls.value == value)
 
     @classmethod
     def find_by_active(cls, active):
@@ -221,13 +1024,13 @@ class Promotion(db.Model):
             active (boolean): the type of the Promotions you want to match
         """
         logger.info("Processing active query for %s ...", active)
-        return cls.query.filter(cls.active == active).all()
+        return cls.query.filter(cls.active == active)
 
     @classmethod
     def find_by_product_id(cls, product_id: int):
-        """Returns the promotion with product_id: product_id """
+        """Returns all Promotions with product_id: product_id """
         logger.info("Processing product_id query for %s ...", product_id)
-        return cls.query.filter(cls.product_id == product_id).all()
+        return cls.query.filter(cls.product_id == product_id)
 
 
     @classmethod
@@ -237,7 +1040,7 @@ class Promotion(db.Model):
             start_date (str): the start date of the Promotions you want to match
         """ 
         logger.info("Processing start date query for %s ...", start_date)
-        return cls.query.filter(cls.start_date == dateutil.parser.parse(start_date))
+        return cls.query.filter(cls._start_date_filter(start_date))
 
     @classmethod
     def find_by_expiration_date(cls, expiration_date:str) -> list:
@@ -246,24 +1049,251 @@ class Promotion(db.Model):
             expiration_date (str): the end date of the Promotions you want to match
         """ 
         logger.info("Processing end date query for %s ...", expiration_date)
-        return cls.query.filter(cls.expiration_date == dateutil.parser.parse(expiration_date))
+        return cls.query.filter(cls._expiration_date_filter(expiration_date))
 
     @classmethod
-    def find_by_availability(cls, available:bool=True) -> list:
+    def find_by_availability(cls, available:bool=True, at:datetime=None) -> list:
         """Returns all Promotions by their availability
         :param available: True for promotions that are available
         :type available: boolean
+        :param at: the time to check availability at, defaults to now
+        :type at: datetime
         :return: a collection of Promotions that are available
         :rtype: list
         """
-        logger.info("Processing available query for %s ...", available)
+        logger.info("Processing available query for %s at %s ...", available, at)
+        return cls.query.filter(cls._available_filter(available, at))
+
+    @classmethod
+    def find_available_at(cls, timestamps: list, query=None) -> list:
+        """Returns the ids of the Promotions available at each of many times
+        The availability windows overlapping the times are read in one query
+        and swept together with the sorted times, so n times against m
+        Promotions cost O((n + m) log m) instead of n queries
+        :param timestamps: the times to check
+        :param query: an optional query that narrows the Promotions
+        :return: a list of Promotion id lists, in the order of the timestamps
+        :rtype: list
+        """
+        logger.info("Processing available query at %d times ...", len(timestamps))
+        timestamps = [parse_date(timestamp) for timestamp in timestamps]
+        if not timestamps:
+            return []
+        query = query if query is not None else cls.query
+        rows = query.filter(
+            cls.start_date <= max(timestamps), cls.expiration_date >= min(timestamps)
+        ).with_entities(cls.start_date, cls.expiration_date, cls.id)
+        return IntervalIndex(rows).sweep(timestamps)
+
+    @classmethod
+    def search(cls, filters: dict):
+        """Returns a query that ANDs together every supplied filter
+        Filters with a value of None are skipped, unknown filters are
+        rejected so that no predicate is ever silently dropped
+        Args:
+            filters (dict): filter name to value, see SEARCH_FILTERS
+        """
+        logger.info("Processing search query for %s ...", filters)
+        return cls.query.filter(*cls.search_criteria(filters))
+
+    @classmethod
+    def search_criteria(cls, filters: dict) -> list:
+        """Returns the SQL criteria of the supplied filters, see search()"""
+        criteria = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in cls.SEARCH_FILTERS:
+                raise DataValidationError("Invalid filter: " + key)
+            criteria.append(getattr(cls, cls.SEARCH_FILTERS[key])(value))
+        return criteria
+
+    @classmethod
+    def _name_filter(cls, name):
+        return cls.name == name
+
+    @classmethod
+    def _product_id_filter(cls, product_id):
+        return cls.product_id == product_id
+
+    @classmethod
+    def _type_filter(cls, type):
+        try:
+            return cls.type == (type if isinstance(type, PromotionType) else PromotionType[type])
+        except KeyError:
+            raise DataValidationError("Invalid promotion type: " + str(type))
+
+    @classmethod
+    def _value_filter(cls, value):
+        return cls.value == value
+
+    @classmethod
+    def _active_filter(cls, active):
+        return cls.active == active
+
+    @classmethod
+    def _start_date_filter(cls, start_date):
+        return cls.start_date == parse_date(start_date)
+
+    @classmethod
+    def _expiration_date_filter(cls, expiration_date):
+        return cls.expiration_date == parse_date(expiration_date)
+
+    @classmethod
+    def _available_filter(cls, available, at=None):
+        at = at or datetime.now()
         if available:
-            return cls.query.filter(
-                cls.start_date <= datetime.now()
-                ).filter(
-                    cls.expiration_date >= datetime.now()
-                )
-        else:
-            return cls.query.filter(
-                (cls.start_date > datetime.now()) | (cls.expiration_date < datetime.now())
-            )
+            return (cls.start_date <= at) & (cls.expiration_date >= at)
+        return (cls.start_date > at) | (cls.expiration_date < at)
+
+    @classmethod
+    def _at_filter(cls, at):
+        return cls._available_filter(True, parse_date(at))
+
+    @classmethod
+    def _expired_filter(cls, expired):
+        now = datetime.now()
+        return cls.expiration_date < now if expired else cls.expiration_date >= now
+
+    SEARCH_FILTERS = {
+        "name": "_name_filter",
+        "product_id": "_product_id_filter",
+        "type": "_type_filter",
+        "value": "_value_filter",
+        "active": "_active_filter",
+        "start_date": "_start_date_filter",
+        "expiration_date": "_expiration_date_filter",
+        "available": "_available_filter",
+        "expired": "_expired_filter",
+        "at": "_at_filter",
+    }
+
+    # most values bound into one IN (...) list
+    IN_CHUNK_SIZE = 1000
+
+    # fields a partial update may change and how each one is read
+    PATCH_FIELDS = {
+        "product_id": read_integer,
+        "value": read_integer,
+        "active": read_boolean,
+        "type": lambda name, value: read_type(value),
+        "start_date": read_date,
+        "expiration_date": read_date,
+    }
+
+    # columns written when a Promotion is inserted, besides version and updated_at
+    INSERT_COLUMNS = ("name", "product_id", "type", "value", "active", "start_date", "expiration_date")
+
+    # INSERT constructs that support ON CONFLICT, by dialect name
+    DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+    SORT_COLUMNS = ("id", "name", "product_id", "type", "value", "active", "start_date", "expiration_date")
+
+    @classmethod
+    def ordered(cls, query, after: int = None, sort: str = "id"):
+        """Orders a query for keyset paging, starting after a cursor
+        :param query: the (possibly filtered) query to order
+        :param after: only return Promotions that sort after the one with this id
+        :param sort: the column to sort by, prefixed with - for descending
+        :return: the ordered query
+        """
+        keys, descending = cls.sort_keys(sort)
+        if after is not None:
+            cursor = db.session.query(*keys).filter(cls.id == after).first() if len(keys) > 1 else (after,)
+            query = query.filter(cls.cursor_criterion(keys, descending, cursor, after))
+        return query.order_by(*cls.sort_order(keys, descending))
+
+    @staticmethod
+    def sort_order(keys: tuple, descending: bool) -> list:
+        """Returns the ORDER BY expressions of a sort, in the order cursor_criterion pages through"""
+        # NULLs sort last ascending and first descending on every database,
+        # which is also the order a PostgreSQL btree index returns them in
+        return [key.desc().nulls_first() if descending else key.asc().nulls_last() for key in keys]
+
+    @classmethod
+    def sort_keys(cls, sort: str) -> tuple:
+        """Returns the columns a sort orders by and whether it is descending"""
+        descending = sort.startswith("-")
+        sort = sort.lstrip("-")
+        if sort not in cls.SORT_COLUMNS:
+            raise DataValidationError("Invalid sort column: " + sort)
+        # the id breaks ties so the cursor is unique whatever the sort column
+        keys = (getattr(cls, sort), cls.id) if sort != "id" else (cls.id,)
+        return keys, descending
+
+    @staticmethod
+    def cursor_criterion(keys: tuple, descending: bool, cursor, after: int):
+        """Returns the criterion for the rows that sort after the cursor row of Promotion after"""
+        if cursor is None:
+            raise DataValidationError("Invalid cursor: promotion {} no longer exists".format(after))
+        position, bound = tuple_(*keys), tuple_(*cursor)
+        criterion = position < bound if descending else position > bound
+        column, id_column = keys[0], keys[-1]
+        if len(keys) == 1 or not column.expression.nullable:
+            return criterion
+        # a tuple comparison with a NULL is never true, so the NULL rows that
+        # sort after the cursor row are matched on their own
+        if cursor[0] is None:
+            if descending:
+                return column.isnot(None) | (column.is_(None) & (id_column < after))
+            return column.is_(None) & (id_column > after)
+        return criterion if descending else criterion | column.is_(None)
+
+    @classmethod
+    def paginate(cls, query, limit: int, after: int = None, sort: str = "id") -> tuple:
+        """Returns one page of a query using the id as a keyset cursor
+        :param query: the (possibly filtered) query to page through
+        :param limit: the maximum number of Promotions to return
+        :param after: only return Promotions that sort after the one with this id
+        :param sort: the column to sort by, prefixed with - for descending
+        :return: the page of Promotions and the cursor for the next page
+        :rtype: tuple
+        """
+        logger.info("Processing page of %s after %s sorted by %s ...", limit, after, sort)
+        # fetch one extra row so we know if there is another page
+        promotions = cls.ordered(query, after, sort).limit(limit + 1).all()
+        next_after = None
+        if len(promotions) > limit:
+            promotions = promotions[:limit]
+            next_after = promotions[-1].id
+        return promotions, next_after
+
+    @classmethod
+    def stream(cls, query, batch_size: int):
+        """Yields the Promotions of a query in batches
+        Rows are fetched with a server-side cursor where the database
+        supports one, so only one batch is held in memory at a time
+        :param query: the ordered query to stream
+        :param batch_size: the number of rows to fetch per round-trip
+        """
+        logger.info("Processing stream in batches of %s ...", batch_size)
+        return query.yield_per(batch_size)
+
+    @classmethod
+    def version_summary(cls, query=None) -> tuple:
+        """Returns the count, latest update and version total of a query
+        These change whenever a matching Promotion is created, updated or
+        deleted, so they identify the state of a listing without reading it
+        """
+        if query is None:
+            query = cls.query
+        return query.order_by(None).with_entities(
+            func.count(cls.id), func.max(cls.updated_at), func.sum(cls.version)
+        ).one()
+
+    @classmethod
+    def estimated_count(cls, query=None) -> int:
+        """Returns a cheap estimate of the number of Promotions
+        An unfiltered count on PostgreSQL is read from the planner statistics
+        instead of scanning the table, anything else falls back to COUNT(*)
+        """
+        if query is None and db.engine.dialect.name == "postgresql":
+            estimate = db.session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+                {"table": cls.__tablename__},
+            ).scalar()
+            if estimate is not None and estimate >= 0:
+                return estimate
+        if query is None:
+            query = cls.query
+        return query.order_by(None).count()
@@ -0,0 +1,103 @@
+"""
+Pricing Engine
+
+Applies BOGO, PERCENTAGE and FIXED promotions to cart lines.
+
+Every cart line is matched against the promotions of its product and the
+discounts of all candidate (line, promotion) pairs are computed with NumPy
+array operations, so a catalog repricing run with 100k+ lines costs a few
+vectorized passes instead of a Python loop per line. Promotions are passed
+in as plain tuples so no ORM attribute is read per line.
+
+- BOGO: every second unit is free
+- PERCENTAGE: value percent off the line
+- FIXED: value off every unit, never below a price of zero
+"""
+import numpy as np
+from service.models import PromotionType
+
+# no promotion applied to a line
+NO_PROMOTION = -1
+
+
+def price_lines(product_ids, unit_prices, quantities, promotions):
+    """
+    Prices cart lines with the best promotion available for each line
+
+    Args:
+        product_ids (array-like): the product id of each line
+        unit_prices (array-like): the price of one unit of each line
+        quantities (array-like): the number of units of each line
+        promotions (list): (id, product_id, PromotionType value, value) tuples
+            of the promotions that may apply to the lines
+
+    Returns:
+        dict: arrays of subtotal, discount, total and the id of the
+        promotion applied to each line (NO_PROMOTION when none applies)
+    """
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    unit_prices = np.asarray(unit_prices, dtype=np.float64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    subtotals = unit_prices * quantities
+    discounts = np.zeros(len(product_ids), dtype=np.float64)
+    applied = np.full(len(product_ids), NO_PROMOTION, dtype=np.int64)
+
+    if len(promotions) and len(product_ids):
+        table = np.asarray(promotions, dtype=np.int64).reshape(-1, 4)
+        # promotions sorted by product so each line owns one contiguous slice
+        table = table[np.argsort(table[:, 1], kind="stable")]
+        promo_ids = table[:, 0]
+        promo_products = table[:, 1]
+        promo_types = table[:, 2]
+        promo_values = table[:, 3].astype(np.float64)
+
+        # look every distinct product up once and share the slice between its lines
+        products, inverse = np.unique(product_ids, return_inverse=True)
+        product_first = np.searchsorted(promo_products, products, side="left")
+        product_counts = np.searchsorted(promo_products, products, side="right") - product_first
+        first = product_first[inverse]
+        counts = product_counts[inverse]
+
+        # expand into one row per candidate (line, promotion) pair, grouped by line
+        lines = np.repeat(np.arange(len(product_ids)), counts)
+        starts = np.cumsum(counts) - counts
+        candidates = np.repeat(first, counts) + np.arange(len(lines)) - np.repeat(starts, counts)
+
+        types = promo_types[candidates]
+        values = promo_values[candidates]
+        prices = unit_prices[lines]
+        units = quantities[lines]
+        candidate_discounts = np.select(
+            [
+                types == PromotionType.BOGO.value,
+                types == PromotionType.PERCENTAGE.value,
+                types == PromotionType.FIXED.value,
+            ],
+            [
+                (units // 2) * prices,
+                subtotals[lines] * np.clip(values, 0, 100) / 100,
+                np.minimum(np.clip(values, 0, None), prices) * units,
+            ],
+            default=0.0,
+        )
+
+        # keep the largest discount of every line, ties go to the lowest promotion id
+        priced = counts > 0
+        segments = starts[priced]
+        best = np.maximum.reduceat(candidate_discounts, segments)
+        winners = np.where(
+            candidate_discounts == np.repeat(best, counts[priced]),
+            promo_ids[candidates],
+            np.iinfo(np.int64).max,
+        )
+        discounts[priced] = best
+        applied[priced] = np.where(best > 0, np.minimum.reduceat(winners, segments), NO_PROMOTION)
+
+    discounts = np.round(discounts, 2)
+    subtotals = np.round(subtotals, 2)
+    return {
+        "subtotal": subtotals,
+        "discount": discounts,
+        "total": np.round(subtotals - discounts, 2),
+        "promotion_id": applied,
+    }
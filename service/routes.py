@@ -4,12 +4,25 @@ Promotion Service
 This microservice handles the lifecycle of Promotions
 """
 
-from flask import jsonify, request, url_for, make_response, abort
-from service.models import Promotion, PromotionType, DataValidationError
+import hashlib
+import json
+import mimetypes
+import os
+import time
+import zlib
+from flask import (
+    jsonify, request, session, url_for, make_response, abort, Response, stream_with_context, send_from_directory
+)
+from service.models import Promotion, PromotionType, DataValidationError, db, parse_date
 from service.common import status  # HTTP Status Codes
-from flask_restx import Api, Resource, fields, reqparse, inputs
-from . import app  # Import Flask application
+from service.common import metrics, replicas, static_assets
+from service.common.compression import ENCODINGS, choose_encoding, etag_matches
+from flask_restx import Api, Resource, fields, reqparse, inputs, marshal
+from . import app, startup_times  # Import Flask application
 from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, quote_etag
+from werkzeug.utils import safe_join
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 ######################################################################
@@ -19,8 +32,36 @@ from datetime import datetime
 def index():
     """Root URL response"""
     """ Index page """
+    dist = os.path.join(app.static_folder, static_assets.DIST_FOLDER)
+    if os.path.isfile(os.path.join(dist, static_assets.INDEX)):
+        # the built page links to hashed assets, so only the page itself is revalidated
+        response = send_from_directory(dist, static_assets.INDEX)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     return app.send_static_file('index.html')
 
+
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    """Serves a built asset, precompressed when the client accepts it"""
+    if filename in (static_assets.INDEX, static_assets.MANIFEST):
+        raise NotFound()
+    dist = os.path.join(app.static_folder, static_assets.DIST_FOLDER)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    precompressed = [
+        encoding for encoding in ENCODINGS
+        if os.path.isfile(safe_join(dist, filename + static_assets.ENCODING_EXTENSIONS[encoding]) or '')
+    ]
+    encoding = choose_encoding(request.accept_encodings, precompressed)
+    if encoding:
+        response = send_from_directory(dist, filename + static_assets.ENCODING_EXTENSIONS[encoding], mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(dist, filename, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f"public, max-age={app.config['ASSET_MAX_AGE']}, immutable"
+    return response
+
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
@@ -69,16 +110,128 @@ promotion_model = api.inherit(
     },
 )
 
+lookup_model = api.model(
+    'PromotionLookup',
+    {
+        'product_ids': fields.List(
+            fields.Integer, required=True, description='The products to find Promotions for'
+        ),
+        'available_at': fields.DateTime(
+            required=False, description='Only return Promotions available at this time'
+        ),
+    }
+)
+
+cart_line_model = api.model(
+    'CartLine',
+    {
+        'product_id': fields.Integer(required=True, description='The product being bought'),
+        'unit_price': fields.Float(required=True, description='The price of one unit'),
+        'quantity': fields.Integer(required=True, description='The number of units'),
+    }
+)
+
+cart_model = api.model(
+    'Cart',
+    {
+        'lines': fields.List(fields.Nested(cart_line_model), required=True, description='The lines to price'),
+        'at': fields.DateTime(required=False, description='Price with the Promotions available at this time'),
+    }
+)
+
+timeline_model = api.model(
+    'AvailabilityTimeline',
+    {
+        'timestamps': fields.List(
+            fields.DateTime, required=True, description='The times to find available Promotions at'
+        ),
+    }
+)
+
 # query string arguments
 # --------------------------------------------------------------------------------------------------
-promotion_args = reqparse.RequestParser()
-promotion_args.add_argument('name', type=str, required=False, location='args', help='List Promotions by name')
-promotion_args.add_argument('product_id', type=int, required=False, location='args', help='The product id associated with this promotion')
-promotion_args.add_argument('type', type=str, required=False, location='args', help='The type of promotion [BOGO | DISCOUNT | FIXED]')
-promotion_args.add_argument('value', type=int, required=False, location='args', help='The value of the promotion based on promo type')
-promotion_args.add_argument('start_date', type=str, required=False, location='args', help='List Promotions by start date')
-promotion_args.add_argument('expiration_date', type=str, required=False, location='args', help='List Promotions by end date')
-promotion_args.add_argument('active', type=inputs.boolean, required=False, location='args', help='List Promotions by active status')
+filter_args = reqparse.RequestParser()
+filter_args.add_argument('name', type=str, required=False, location='args', help='List Promotions by name')
+filter_args.add_argument(
+    'product_id', type=int, required=False, location='args', help='The product id associated with this promotion'
+)
+filter_args.add_argument(
+    'type', type=str, required=False, location='args', help='The type of promotion [BOGO | DISCOUNT | FIXED]'
+)
+filter_args.add_argument(
+    'value', type=int, required=False, location='args', help='The value of the promotion based on promo type'
+)
+filter_args.add_argument('start_date', type=str, required=False, location='args', help='List Promotions by start date')
+filter_args.add_argument('expiration_date', type=str, required=False, location='args', help='List Promotions by end date')
+filter_args.add_argument(
+    'active', type=inputs.boolean, required=False, location='args', help='List Promotions by active status'
+)
+filter_args.add_argument(
+    'available', type=inputs.boolean, required=False, location='args', help='List Promotions that are available now'
+)
+filter_args.add_argument(
+    'expired', type=inputs.boolean, required=False, location='args', help='List Promotions that have expired'
+)
+filter_args.add_argument(
+    'at', type=str, required=False, location='args', help='List Promotions that were available at this time'
+)
+
+promotion_args = filter_args.copy()
+promotion_args.add_argument(
+    'sort', type=str, required=False, location='args', help='Sort by a column, prefix with - for descending'
+)
+promotion_args.add_argument(
+    'limit', type=inputs.positive, required=False, location='args', help='The maximum number of Promotions to return'
+)
+promotion_args.add_argument(
+    'after', type=inputs.natural, required=False, location='args',
+    help='Only list Promotions that sort after the Promotion with this id'
+)
+promotion_args.add_argument(
+    'count', type=inputs.boolean, required=False, location='args', help='Return an estimated X-Total-Count header'
+)
+promotion_args.add_argument(
+    'stream', type=inputs.boolean, required=False, location='args', help='Stream every matching Promotion as chunked JSON'
+)
+
+create_args = reqparse.RequestParser()
+create_args.add_argument(
+    'upsert', type=inputs.boolean, required=False, location='args', help='Overwrite a Promotion with the same name'
+)
+
+available_args = reqparse.RequestParser()
+available_args.add_argument(
+    'product_id', type=int, required=True, location='args', help='The product to find available Promotions for'
+)
+available_args.add_argument(
+    'at', type=str, required=False, location='args', help='The time to check availability at, defaults to now'
+)
+
+best_args = reqparse.RequestParser()
+best_args.add_argument(
+    'product_id', type=int, required=True, location='args', help='The product to find the best Promotion for'
+)
+best_args.add_argument(
+    'at', type=str, required=False, location='args', help='The time to check availability at, defaults to now'
+)
+best_args.add_argument(
+    'unit_price', type=float, required=False, location='args',
+    help='Rank Promotions for this unit price instead of the reference price'
+)
+
+# query string arguments that control paging rather than filtering
+PAGING_ARGS = ('limit', 'after', 'count', 'sort', 'stream')
+
+# bulk updates and deletes must be filtered unless every Promotion is meant
+bulk_args = filter_args.copy()
+bulk_args.add_argument(
+    'all', type=inputs.boolean, required=False, location='args', help='Apply to every Promotion when no filter is given'
+)
+
+NDJSON = 'application/x-ndjson'
+
+# zlib window bits that read a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
 
 
 ######################################################################
@@ -87,10 +240,17 @@ promotion_args.add_argument('active', type=inputs.boolean, required=False, locat
 
 
 def init_db():
-    """ Initializes the SQLAlchemy app """
+    """ Initializes the SQLAlchemy app without connecting to the database """
     global app
     Promotion.init_db(app)
 
+@app.after_request
+def remember_write(response):
+    """Makes a client that just wrote read from the primary until the replicas catch up"""
+    if db.replicas.engines and replicas.is_write() and response.status_code < 400:
+        session[replicas.PRIMARY_UNTIL] = time.time() + app.config['READ_YOUR_WRITES_SECONDS']
+    return response
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
@@ -102,6 +262,185 @@ def check_content_type(media_type):
         f"Content-Type must be {media_type}",
     )
 
+def promotion_etag(promotion):
+    """Returns the strong entity tag of a Promotion's current version"""
+    return f"{promotion.id}-{promotion.version}"
+
+
+def validators(etag, last_modified):
+    """Returns the ETag and Last-Modified headers of a response"""
+    headers = {'ETag': quote_etag(etag)}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified(etag):
+    """Checks if the client already has this version, in any encoding, from If-None-Match"""
+    return etag_matches(request.if_none_match, etag)
+
+
+def collection_etag(promotions, next_after):
+    """Builds a page's entity tag from the ids and versions of the rows it serves
+    A page's body is those rows and the link to the next page, so the tag costs
+    nothing beyond the page query, however large the filtered listing is
+    """
+    state = hashlib.sha1(f"{request.query_string.decode()}|{request.accept_mimetypes}|{next_after}".encode())
+    for promotion in promotions:
+        state.update(f"|{promotion.id}-{promotion.version}".encode())
+    last_modified = max((promotion.updated_at for promotion in promotions), default=None)
+    return state.hexdigest(), last_modified
+
+
+def wants_ndjson():
+    """Checks if the client asked for newline delimited JSON"""
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def json_response(body, code, headers):
+    """Returns JSON that was already serialized, so it is not marshalled again
+    The routes still document their promotion_model with @api.response
+    """
+    return Response(body, status=code, headers=headers, mimetype='application/json')
+
+
+def generate_json(promotions, batch_size, ndjson=False):
+    """Serializes Promotions as they are fetched, one chunk per batch"""
+    chunk = [] if ndjson else ['[']
+    for count, promotion in enumerate(promotions):
+        if count and not ndjson:
+            chunk.append(',')
+        chunk.append(promotion.to_json().decode())
+        if ndjson:
+            chunk.append('\n')
+        if (count + 1) % batch_size == 0:
+            yield ''.join(chunk)
+            chunk = []
+    if not ndjson:
+        chunk.append(']')
+    yield ''.join(chunk)
+
+
+def gunzip(body, limit):
+    """Decompresses a gzip body without ever holding more than limit bytes of it"""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error as error:
+        raise DataValidationError("Invalid gzip body: " + str(error))
+    if len(data) > limit:
+        raise DataValidationError(f"Bulk body cannot be larger than {limit} bytes once decompressed")
+    if not decompressor.eof:
+        raise DataValidationError("Invalid gzip body: the compressed data is truncated")
+    return data
+
+
+def read_bulk_rows():
+    """Reads the rows of a bulk request from a JSON array or NDJSON body"""
+    body = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        body = gunzip(body, app.config['BULK_MAX_BYTES'])
+    try:
+        if request.mimetype == NDJSON:
+            rows = [json.loads(line) for line in body.splitlines() if line.strip()]
+        elif request.mimetype == 'application/json':
+            rows = json.loads(body)
+        else:
+            abort(
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                f"Content-Type must be application/json or {NDJSON}",
+            )
+    except ValueError as error:
+        raise DataValidationError("Invalid JSON body: " + str(error))
+    if not isinstance(rows, list):
+        raise DataValidationError("Bulk body must be a JSON array of Promotions")
+    if len(rows) > app.config['BULK_MAX_ROWS']:
+        raise DataValidationError(f"Bulk body cannot contain more than {app.config['BULK_MAX_ROWS']} Promotions")
+    return rows
+
+
+def validate_bulk_rows(rows):
+    """Validates every row of a bulk request
+    Returns the result of every row in order and the Promotions to create
+    """
+    names = [row.get('name') for row in rows if isinstance(row, dict)]
+    existing = Promotion.existing_names([name for name in names if isinstance(name, str)])
+    results = []
+    promotions = []
+    for index, row in enumerate(rows):
+        try:
+            promotion = Promotion.from_row(row)
+            if promotion.name in existing:
+                raise DataValidationError(f"Promotion with name {promotion.name} already exists")
+        except DataValidationError as error:
+            results.append({"index": index, "error": str(error)})
+            continue
+        existing.add(promotion.name)
+        promotions.append(promotion)
+        results.append({"index": index, "promotion": promotion})
+    return results, promotions
+
+
+def bulk_query():
+    """Builds the query for a bulk update or delete from the query string"""
+    args = bulk_args.parse_args()
+    filters = {key: value for key, value in args.items() if key != 'all' and value is not None}
+    if not filters and not args['all']:
+        raise DataValidationError("A filter or all=true is required to change every Promotion")
+    app.logger.info("Request to change promotions matching %s ...", filters)
+    return Promotion.search(filters)
+
+
+def read_cart_lines(lines):
+    """Reads the product ids, unit prices and quantities of cart lines"""
+    if not isinstance(lines, list):
+        raise DataValidationError("lines must be a list of cart lines")
+    if len(lines) > app.config['PRICE_MAX_LINES']:
+        raise DataValidationError(f"Cannot price more than {app.config['PRICE_MAX_LINES']} lines at once")
+    try:
+        product_ids = [line['product_id'] for line in lines]
+        unit_prices = [line['unit_price'] for line in lines]
+        quantities = [line['quantity'] for line in lines]
+    except (KeyError, TypeError) as error:
+        raise DataValidationError("Invalid cart line: missing " + str(error))
+    for name, values, kinds in (
+        ('product_id', product_ids, int), ('unit_price', unit_prices, (int, float)), ('quantity', quantities, int)
+    ):
+        if not all(isinstance(value, kinds) and not isinstance(value, bool) and value >= 0 for value in values):
+            raise DataValidationError(f"Invalid cart line: {name} must be a number that is not negative")
+    return product_ids, unit_prices, quantities
+
+
+def stream_promotions(query, args, headers):
+    """Streams every Promotion of a listing as chunked JSON or NDJSON"""
+    app.logger.info('Streaming promotions.')
+    query = Promotion.ordered(query, args['after'], args['sort'] or 'id')
+    if args['limit']:
+        query = query.limit(args['limit'])
+    batch_size = app.config['STREAM_BATCH_SIZE']
+    ndjson = wants_ndjson()
+    return Response(
+        stream_with_context(generate_json(Promotion.stream(query, batch_size), batch_size, ndjson)),
+        status=status.HTTP_200_OK,
+        headers=headers,
+        mimetype=NDJSON if ndjson else 'application/json',
+    )
+
+
+def page_in_memory(promotions, limit, after):
+    """Returns one page of Promotions ordered by id and the cursor for the next page"""
+    promotions = [promo for promo in promotions if after is None or promo.id > after]
+    next_after = promotions[limit - 1].id if len(promotions) > limit else None
+    return promotions[:limit], next_after
+
+
+def next_page_url(after, limit):
+    """Builds the url of the next page keeping the current query string"""
+    query_args = request.args.to_dict()
+    query_args['after'] = after
+    query_args['limit'] = limit
+    return url_for(request.endpoint, _external=True, **query_args)
+
 ######################################################################
 #  PATH: /promotions
 ######################################################################
@@ -114,76 +453,313 @@ class PromotionCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_promotions')
     @api.expect(promotion_args, validate=True)
-    @api.marshal_list_with(promotion_model)
+    @api.produces(['application/json', NDJSON])
+    @api.response(200, 'Success', [promotion_model])
     def get(self):
         """ Returns all of the Promotions """
         args = promotion_args.parse_args()
-        all_promotions = []
         app.logger.info("Request to list promotions based on query string %s ...", args)
-        if args['name']:
-            app.logger.info('Filtering by name: %s', args['name'])
-            all_promotions = Promotion.find_by_name(args['name'])
-        elif args['product_id']:
-            app.logger.info('Filtering by product id %s', args['product_id'])
-            all_promotions = Promotion.find_by_product_id(args['product_id'])
-        elif args['type']:
-            app.logger.info('Filtering by type %s', args['type'])
-            all_promotions = Promotion.find_by_type(args['type'])
-        elif args['value']:
-            app.logger.info('Filtering by value %s', args['value'])
-            all_promotions = Promotion.find_by_value(args['value'])
-        elif args['active']:
-            app.logger.info('Filtering by active %s', args['active'])
-            all_promotions = Promotion.find_by_active(args['active'])
-        elif args['start_date']:
-            app.logger.info('Filtering by start date %s', args['start_date'])
-            all_promotions = Promotion.find_by_start_date(args['start_date'])
-        elif args['expiration_date']:
-            app.logger.info('Filtering by end date %s', args['expiration_date'])
-            all_promotions = Promotion.find_by_expiration_date(args['expiration_date'])
+        filters = {
+            key: value for key, value in args.items()
+            if key not in PAGING_ARGS and value is not None
+        }
+        if filters:
+            app.logger.info('Filtering by %s', filters)
         else:
             app.logger.info('Returning unfiltered list.')
-            all_promotions = Promotion.all()
-        results = [promo.serialize() for promo in all_promotions]
-        app.logger.info("Returning %d promotions", len(results))
-        return results, status.HTTP_200_OK
+        query = Promotion.search(filters)
+        if args['stream'] or wants_ndjson():
+            # a stream is written as it is read, so it has no validators
+            return stream_promotions(query, args, {})
+
+        limit = min(args['limit'] or app.config['PAGE_SIZE_DEFAULT'], app.config['PAGE_SIZE_MAX'])
+        cached = None
+        if list(filters) == ['product_id'] and args['sort'] in (None, 'id'):
+            # None when the product has too many Promotions to cache
+            cached = Promotion.find_by_product_id_cached(filters['product_id'])
+        if cached is not None:
+            promotions, next_after = page_in_memory(cached, limit, args['after'])
+        else:
+            promotions, next_after = Promotion.paginate(query, limit, args['after'], args['sort'] or 'id')
+        etag, last_modified = collection_etag(promotions, next_after)
+        headers = validators(etag, last_modified)
+        if not_modified(etag):
+            return '', status.HTTP_304_NOT_MODIFIED, headers
+        if next_after is not None:
+            headers['Link'] = '<{}>; rel="next"'.format(next_page_url(next_after, limit))
+        if args['count']:
+            headers['X-Total-Count'] = str(Promotion.estimated_count(query if filters else None))
+        app.logger.info("Returning %d promotions", len(promotions))
+        return json_response(Promotion.list_to_json(promotions), status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # CREATE A PROMOTION
     # ------------------------------------------------------------------
     @api.doc('create_promotions')
     @api.response(400, 'The posted data was not valid')
-    @api.expect(create_model)
+    @api.response(409, 'A Promotion with the same name already exists')
+    @api.expect(create_args, create_model)
     @api.marshal_with(promotion_model, code=201)
     def post(self):
         """
         Creates a Promotion
-        This endpoint will create an Promotion based the data in the body that is posted
+        This endpoint will create an Promotion based the data in the body that is posted,
+        with upsert=true a Promotion with the same name is overwritten instead
         """
         app.logger.info("Request to create a Promotion")
         check_content_type("application/json")
+        upsert = bool(create_args.parse_args()['upsert'])
         args = request.get_json()
-        promotion_exist = Promotion.find_by_name(args['name'])
-
-        if promotion_exist:
-            abort(
-                status.HTTP_409_CONFLICT,
-                f"Promotion with id {args['id']} and name {args['name']} already exists",
-            )
-
-
 
         # Create the promotion
         promotion = Promotion()
         promotion = promotion.deserialize(args)
-        if args['type'] == "BOGO":
+        if promotion.type == PromotionType.BOGO:
             promotion.value = 0
-        promotion.create()
+        created = promotion.create(upsert=upsert)
         # Create a message to return
         message = promotion.serialize()
         location_url = api.url_for(PromotionResource, promotion_id=promotion.id, _external=True)
+        headers = dict(validators(promotion_etag(promotion), promotion.updated_at), Location=location_url)
+        if not created:
+            app.logger.info("Promotion with ID [%s] overwritten.", promotion.id)
+            return message, status.HTTP_200_OK, headers
         app.logger.info("Promotion with ID [%s] created.", promotion.id)
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return message, status.HTTP_201_CREATED, headers
+
+    # ------------------------------------------------------------------
+    # UPDATE ALL MATCHING PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('bulk_update_promotions')
+    @api.response(400, 'The filter or the patch was not valid')
+    @api.expect(bulk_args, create_model, validate=False)
+    def patch(self):
+        """
+        Updates every Promotion that matches the query string
+        This endpoint applies the fields in the body to all matching Promotions in one statement
+        """
+        check_content_type("application/json")
+        query = bulk_query()
+        values = Promotion.deserialize_partial(request.get_json())
+        count = Promotion.bulk_update(query, values)
+        app.logger.info("Updated %d Promotions", count)
+        return {"updated": count}, status.HTTP_200_OK
+
+    # ------------------------------------------------------------------
+    # DELETE ALL MATCHING PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('bulk_delete_promotions')
+    @api.response(400, 'The filter was not valid')
+    @api.expect(bulk_args, validate=True)
+    def delete(self):
+        """
+        Deletes every Promotion that matches the query string
+        This endpoint removes all matching Promotions in one statement
+        """
+        query = bulk_query()
+        count = Promotion.bulk_delete(query)
+        app.logger.info("Deleted %d Promotions", count)
+        return {"deleted": count}, status.HTTP_200_OK
+
+######################################################################
+# PATH /promotions/available
+######################################################################
+@api.route('/promotions/available')
+class AvailableResource(Resource):
+    """ Finds the Promotions that apply to a product at a point in time """
+
+    @api.doc('list_available_promotions')
+    @api.expect(available_args, validate=True)
+    @api.marshal_list_with(promotion_model)
+    def get(self):
+        """
+        Returns the active Promotions of a product that are available at a time
+        This endpoint is answered from an in-memory index of availability windows
+        """
+        args = available_args.parse_args()
+        at = parse_date(args['at']) if args['at'] else None
+        app.logger.info("Request for promotions of product %s available at %s", args['product_id'], at)
+        promotions = Promotion.find_available(args['product_id'], at)
+        return [promotion.serialize() for promotion in promotions], status.HTTP_200_OK
+
+    @api.doc('list_available_promotions_at_times')
+    @api.response(200, 'The ids of the Promotions available at every time')
+    @api.response(400, 'The posted timestamps were not valid')
+    @api.expect(timeline_model)
+    @replicas.read_only
+    def post(self):
+        """
+        Returns the Promotions available at many times
+        The query string narrows the Promotions with the same filters as the collection
+        """
+        check_content_type("application/json")
+        data = request.get_json()
+        timestamps = data.get('timestamps') if isinstance(data, dict) else None
+        if not isinstance(timestamps, list) or not all(isinstance(timestamp, str) for timestamp in timestamps):
+            raise DataValidationError("timestamps must be a list of date strings")
+        if len(timestamps) > app.config['AVAILABLE_MAX_TIMESTAMPS']:
+            raise DataValidationError(
+                f"Cannot check more than {app.config['AVAILABLE_MAX_TIMESTAMPS']} timestamps at once"
+            )
+        filters = {key: value for key, value in filter_args.parse_args().items() if value is not None}
+        app.logger.info("Request for promotions available at %d times filtered by %s", len(timestamps), filters)
+        found = Promotion.find_available_at(timestamps, Promotion.search(filters))
+        return [
+            {"at": timestamp, "promotion_ids": promotion_ids}
+            for timestamp, promotion_ids in zip(timestamps, found)
+        ], status.HTTP_200_OK
+
+######################################################################
+# PATH /promotions/best
+######################################################################
+@api.route('/promotions/best')
+class BestResource(Resource):
+    """ Finds the best Promotion that applies to a product """
+
+    @api.doc('get_best_promotion')
+    @api.response(404, 'No Promotion applies to the product')
+    @api.expect(best_args, validate=True)
+    @api.marshal_with(promotion_model)
+    def get(self):
+        """
+        Returns the Promotion with the largest discount on a product
+        Ties go to the Promotion that expires first
+        """
+        args = best_args.parse_args()
+        at = parse_date(args['at']) if args['at'] else None
+        if args['unit_price'] is not None and args['unit_price'] < 0:
+            raise DataValidationError("unit_price must not be negative")
+        app.logger.info("Request for the best promotion of product %s at %s", args['product_id'], at)
+        promotion = Promotion.find_best(args['product_id'], at, args['unit_price'])
+        if not promotion:
+            abort(status.HTTP_404_NOT_FOUND, f"No Promotion applies to product {args['product_id']}")
+        return promotion.serialize(), status.HTTP_200_OK
+
+######################################################################
+# PATH /promotions/lookup
+######################################################################
+@api.route('/promotions/lookup')
+class LookupResource(Resource):
+    """ Finds the Promotions of many products in one request """
+
+    @api.doc('lookup_promotions')
+    @api.response(200, 'A map of every product id to its Promotions')
+    @api.response(400, 'The posted lookup was not valid')
+    @api.expect(lookup_model)
+    @replicas.read_only
+    def post(self):
+        """
+        Returns the Promotions of many products
+        This endpoint answers with one database query however many products are asked for
+        """
+        check_content_type("application/json")
+        data = request.get_json()
+        product_ids = data.get('product_ids') if isinstance(data, dict) else None
+        if not isinstance(product_ids, list) or not all(
+            isinstance(product_id, int) and not isinstance(product_id, bool) for product_id in product_ids
+        ):
+            raise DataValidationError("product_ids must be a list of Integers")
+        if len(product_ids) > app.config['LOOKUP_MAX_PRODUCTS']:
+            raise DataValidationError(f"Cannot look up more than {app.config['LOOKUP_MAX_PRODUCTS']} products at once")
+        available_at = parse_date(data['available_at']) if data.get('available_at') is not None else None
+        app.logger.info("Request to look up promotions of %d products", len(product_ids))
+
+        found = Promotion.find_by_product_ids(product_ids, available_at)
+        results = {
+            str(product_id): marshal([promotion.serialize() for promotion in promotions], promotion_model)
+            for product_id, promotions in found.items()
+        }
+        return results, status.HTTP_200_OK
+
+######################################################################
+# PATH /promotions/price
+######################################################################
+@api.route('/promotions/price')
+class PriceResource(Resource):
+    """ Prices a cart with the Promotions that apply to it """
+
+    @api.doc('price_cart')
+    @api.response(200, 'The discounted price of every line and of the cart')
+    @api.response(400, 'The posted cart was not valid')
+    @api.expect(cart_model)
+    @replicas.read_only
+    def post(self):
+        """
+        Prices a cart
+        This endpoint applies the best active and available Promotion to every cart line
+        """
+        check_content_type("application/json")
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise DataValidationError("Cart must be a JSON object with lines")
+        product_ids, unit_prices, quantities = read_cart_lines(data.get('lines'))
+        at = parse_date(data['at']) if data.get('at') is not None else datetime.now()
+        app.logger.info("Request to price %d cart lines", len(product_ids))
+
+        # NumPy is only loaded by the workers that price carts
+        from service.pricing import price_lines, NO_PROMOTION  # pylint: disable=import-outside-toplevel
+
+        terms = Promotion.find_pricing_terms(product_ids, at)
+        priced = price_lines(product_ids, unit_prices, quantities, terms)
+        lines = [
+            {
+                "product_id": product_id,
+                "unit_price": unit_price,
+                "quantity": quantity,
+                "subtotal": subtotal,
+                "discount": discount,
+                "total": total,
+                "promotion_id": None if promotion_id == NO_PROMOTION else promotion_id,
+            }
+            for product_id, unit_price, quantity, subtotal, discount, total, promotion_id in zip(
+                product_ids, unit_prices, quantities, priced["subtotal"].tolist(), priced["discount"].tolist(),
+                priced["total"].tolist(), priced["promotion_id"].tolist(),
+            )
+        ]
+        message = {
+            "lines": lines,
+            "subtotal": round(float(priced["subtotal"].sum()), 2),
+            "discount": round(float(priced["discount"].sum()), 2),
+            "total": round(float(priced["total"].sum()), 2),
+        }
+        return message, status.HTTP_200_OK
+
+######################################################################
+# PATH /promotions/bulk
+######################################################################
+@api.route('/promotions/bulk')
+class BulkResource(Resource):
+    """ Creates many Promotions in one request """
+
+    @api.doc('bulk_create_promotions')
+    @api.response(201, 'Promotions created')
+    @api.response(400, 'None of the posted Promotions were valid')
+    @api.response(409, 'A Promotion name was taken while the request ran')
+    @api.expect([create_model])
+    def post(self):
+        """
+        Creates many Promotions
+        This endpoint accepts a JSON array or NDJSON body, optionally gzip encoded,
+        and returns the id or the error of every row in the order they were posted
+        """
+        rows = read_bulk_rows()
+        app.logger.info("Request to bulk create %d Promotions", len(rows))
+        results, promotions = validate_bulk_rows(rows)
+
+        try:
+            Promotion.bulk_create(promotions, app.config['BULK_CHUNK_SIZE'])
+        except IntegrityError as error:
+            abort(status.HTTP_409_CONFLICT, f"Promotions could not be created: {error.orig}")
+
+        for result in results:
+            if "promotion" in result:
+                result["id"] = result.pop("promotion").id
+        errors = len(results) - len(promotions)
+        app.logger.info("Bulk created %d Promotions with %d errors", len(promotions), errors)
+        message = {"created": len(promotions), "errors": errors, "results": results}
+        if errors and not promotions:
+            return message, status.HTTP_400_BAD_REQUEST
+        return message, status.HTTP_201_CREATED
 
 ######################################################################
 # PATH /promotions/{promotion_id}
@@ -203,7 +779,8 @@ class PromotionResource(Resource):
     #------------------------------------------------------------------
     @api.doc('get_promotion')
     @api.response(404, 'Promotion not found')
-    @api.marshal_with(promotion_model)
+    @api.response(304, 'Promotion not modified since the If-None-Match version')
+    @api.response(200, 'Success', promotion_model)
     def get(self, promotion_id):
         """
         Retrieve a single Promotion
@@ -213,7 +790,11 @@ class PromotionResource(Resource):
         promotion = Promotion.find(promotion_id)
         if not promotion:
             raise NotFound("Promotion with id '{}' was not found.".format(promotion_id))
-        return promotion.serialize(), status.HTTP_200_OK
+        etag = promotion_etag(promotion)
+        headers = validators(etag, promotion.updated_at)
+        if not_modified(etag):
+            return '', status.HTTP_304_NOT_MODIFIED, headers
+        return json_response(promotion.to_json(), status.HTTP_200_OK, headers)
 
     #------------------------------------------------------------------
     # UPDATE AN EXISTING PROMOTION
@@ -222,6 +803,8 @@ class PromotionResource(Resource):
     @api.doc('update_promotion')
     @api.response(404, 'Promotion not found')
     @api.response(400, 'The posted Promotion data was not valid')
+    @api.response(409, 'The Promotion was changed by another request')
+    @api.response(412, 'The Promotion does not match the If-Match version')
     @api.expect(promotion_model)
     @api.marshal_with(promotion_model)
     def put(self, promotion_id):
@@ -230,11 +813,16 @@ class PromotionResource(Resource):
         This endpoint will update a Promotion based the body that is posted
         """
         app.logger.info('Request to Update a Promotion with id [%s]', promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find_current(promotion_id)
         if not promotion:
             abort(
                 status.HTTP_404_NOT_FOUND, f"Promotion with id '{promotion_id}' was not found."
             )
+        if request.if_match and not etag_matches(request.if_match, promotion_etag(promotion)):
+            abort(
+                status.HTTP_412_PRECONDITION_FAILED,
+                f"Promotion with id '{promotion_id}' has been changed since it was read.",
+            )
 
         app.logger.debug('Payload = %s', api.payload)
         # Update from the json in the body of the request
@@ -246,7 +834,7 @@ class PromotionResource(Resource):
             f"Promotion with id {id} updated"
         )
 
-        return promotion.serialize(), status.HTTP_200_OK
+        return promotion.serialize(), status.HTTP_200_OK, validators(promotion_etag(promotion), promotion.updated_at)
     
     #------------------------------------------------------------------
     # DELETE A PROMOTION
@@ -259,7 +847,7 @@ class PromotionResource(Resource):
         This endpoint will delete an Promotion based the id specified in the path
         """
         app.logger.info('Request to Delete a Promotion with id [%s]', promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find_current(promotion_id)
         if promotion:
             promotion.delete()
             app.logger.info('Promotion with id [%s] was deleted', promotion_id)
@@ -280,7 +868,7 @@ class ActivateResource(Resource):
         This endpoint will activate a Promotion
         """
         app.logger.info('Request to activate promotion with id: %s', promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find_current(promotion_id)
         if promotion is None:
             abort(status.HTTP_404_NOT_FOUND, "Promotion with id '{}' was not found".format(promotion_id))
 
@@ -302,7 +890,7 @@ class DeactivateResource(Resource):
         This endpoint will activate a Promotion
         """
         app.logger.info('Request to deactivate promotion with id: %s', promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find_current(promotion_id)
         if promotion is None:
             abort(status.HTTP_404_NOT_FOUND, "Promotion with id '{}' was not found".format(promotion_id))
 
@@ -310,6 +898,29 @@ class DeactivateResource(Resource):
         promotion.update()
         return promotion.serialize(), status.HTTP_200_OK
 
+######################################################################
+# Diagnostics for this worker process
+######################################################################
+@app.route("/diagnostics", methods=["GET"])
+def diagnostics():
+    """Returns the in-process statistics of this worker"""
+    return (
+        jsonify(
+            cache=Promotion.cache.stats(),
+            pool=Promotion.pool_stats(),
+            replicas=db.replicas.stats(),
+            startup=startup_times,
+        ),
+        status.HTTP_200_OK,
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Returns the metrics of every worker in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
 ######################################################################
 # Health check for Kube
 ######################################################################
@@ -37,6 +37,14 @@ $(function () {
         $("#flash_message").append(message);
     }
 
+    // Sends a whole number as a JSON number, an empty field as null and anything else as typed
+    function integer_field(text) {
+        if (text === "") {
+            return null
+        }
+        return /^-?\d+$/.test(text.trim()) ? parseInt(text) : text
+    }
+
     // ****************************************
     // Create a promotion
     // ****************************************
@@ -68,7 +76,7 @@ $(function () {
             "type": type,
             "active": active,
             "product_id": parseInt(product_id),
-            "value": value,
+            "value": integer_field(value),
             "start_date": start,
             "expiration_date": end
         };
@@ -114,7 +122,7 @@ $(function () {
             "type": type,
             "active": active,
             "product_id": parseInt(product_id),
-            "value": value,
+            "value": integer_field(value),
             "start_date": start,
             "expiration_date": end
         };
@@ -238,14 +246,7 @@ $(function () {
 
         $("#flash_message").empty();
 
-        let ajax = $.ajax({
-            type: "GET",
-            url: `/promotions?${queryString}`,
-            contentType: "application/json",
-            data: ''
-        })
-
-        ajax.done(function(res){
+        get_all_pages(`/promotions?${queryString}`, [], function(res){
             //alert(res.toSource())
             $("#search_results").empty();
             let table = '<table class="table table-striped" cellpadding="10">'
@@ -278,11 +279,37 @@ $(function () {
             flash_message("Success")
         });
 
+    });
+
+    // Follows the rel="next" Link of every page and hands all the results to done
+    function get_all_pages(url, results, done) {
+        let ajax = $.ajax({
+            type: "GET",
+            url: url,
+            contentType: "application/json",
+            data: ''
+        })
+
+        ajax.done(function(res){
+            results = results.concat(res)
+            let next = next_page_url(ajax.getResponseHeader("Link"))
+            if (next) {
+                get_all_pages(next, results, done)
+            } else {
+                done(results)
+            }
+        });
+
         ajax.fail(function(res){
             flash_message(res.responseJSON.message)
         });
+    }
 
-    });
+    // Returns the url of the rel="next" Link, or null on the last page
+    function next_page_url(link) {
+        let match = link ? link.match(/<([^>]*)>;\s*rel="next"/) : null
+        return match ? match[1] : null
+    }
 
 
     // ****************************************
@@ -2,10 +2,14 @@
 CLI Command Extensions for Flask
 """
 import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.models import DataValidationError
+from service.common.cli_commands import (
+    build_static, db_create, db_migrate, load_test, promotions_export, promotions_import, seed_promotions
+)
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +25,90 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.Promotion')
+    def test_db_migrate(self, promotion_mock):
+        """It should call the db-migrate command"""
+        promotion_mock.migrate.return_value = ["Created index ix_promotion_name"]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_migrate)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Created index ix_promotion_name", result.output)
+            promotion_mock.migrate.assert_called_once()
+
+    @patch('service.common.cli_commands.Promotion')
+    def test_db_migrate_duplicates(self, promotion_mock):
+        """It should report why db-migrate could not build an index"""
+        promotion_mock.migrate.side_effect = DataValidationError("Cannot create unique index ix_promotion_name")
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_migrate)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("Cannot create unique index ix_promotion_name", result.output)
+
+    @patch('service.common.cli_commands.static_assets')
+    def test_build_static(self, static_assets_mock):
+        """It should call the build-static command"""
+        static_assets_mock.build.return_value = {"js/rest_api.js": "js/rest_api.0123456789ab.js"}
+        static_assets_mock.DIST_FOLDER = "dist"
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(build_static)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Built 1 assets", result.output)
+            static_assets_mock.build.assert_called_once()
+
+    @patch('service.common.cli_commands.seeding')
+    def test_seed_promotions(self, seeding_mock):
+        """It should call the seed-promotions command"""
+        seeding_mock.seed_promotions.return_value = 500
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(seed_promotions, ["--count", "500", "--products", "10", "--seed", "3"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Seeded 500 Promotions", result.output)
+            self.assertEqual(seeding_mock.seed_promotions.call_args[0][:4], (500, 10, 10000, 3))
+
+    @patch('service.common.cli_commands.loadtest.run')
+    def test_loadtest(self, run_mock):
+        """It should call the loadtest command"""
+        run_mock.return_value = {
+            "requests": 3, "errors": 0, "seconds": 0.1, "requests_per_second": 30.0,
+            "operations": {"get": {
+                "requests": 3, "errors": 0, "p50_ms": 1.0, "p90_ms": 2.0, "p99_ms": 3.0, "max_ms": 3.0,
+                "buckets": {"<=1ms": 1, "<=2ms": 1, "<=5ms": 1},
+            }},
+        }
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(load_test, ["--requests", "3", "--mix", "get=1"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("get: 3 requests", result.output)
+            self.assertEqual(run_mock.call_args[0][1:4], (3, 8, {"get": 1}))
+            result = self.runner.invoke(load_test, ["--mix", "get=1,delete=2"])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn("Unknown operation delete", result.output)
+
+    @patch('service.common.cli_commands.transfer.export_promotions')
+    def test_promotions_export(self, export_mock):
+        """It should call the promotions-export command"""
+        with tempfile.TemporaryDirectory() as folder, patch.dict(os.environ, {"FLASK_APP": "service:app"}):
+            result = self.runner.invoke(promotions_export, [os.path.join(folder, "promotions.jsonl")])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(export_mock.call_args[0][1:3], ("jsonl", 10000))
+            result = self.runner.invoke(promotions_export, [os.path.join(folder, "promotions.txt")])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn("Cannot tell the format", result.output)
+
+    @patch('service.common.cli_commands.transfer.import_promotions')
+    def test_promotions_import(self, import_mock):
+        """It should call the promotions-import command and resume from its checkpoint"""
+        with tempfile.TemporaryDirectory() as folder, patch.dict(os.environ, {"FLASK_APP": "service:app"}):
+            path = os.path.join(folder, "promotions.csv")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("name\n")
+            result = self.runner.invoke(promotions_import, [path, "--batch-size", "5"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(import_mock.call_args[0][:3], (path, "csv", 5))
+            self.assertNotIn("Resuming", result.output)
+
+            import_mock.call_args[0][3].save(5, 1, 1, 0)
+            result = self.runner.invoke(promotions_import, [path])
+            self.assertIn("Resuming after row 1", result.output)
+            self.assertFalse(os.path.exists(path + ".checkpoint"))
@@ -0,0 +1,50 @@
+"""
+Test cases for the Interval Index
+
+"""
+import unittest
+from service.common.interval_index import IntervalIndex
+
+
+######################################################################
+#  I N T E R V A L   I N D E X   T E S T   C A S E S
+######################################################################
+class TestIntervalIndex(unittest.TestCase):
+    """ Test Cases for IntervalIndex """
+
+    def test_empty_index(self):
+        """It should find nothing in an empty index"""
+        index = IntervalIndex([])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.containing(5), [])
+        self.assertEqual(index.sweep([5, 6]), [[], []])
+
+    def test_containing(self):
+        """It should find every interval that contains a point"""
+        index = IntervalIndex([(1, 10, "a"), (3, 4, "b"), (5, 7, "c"), (8, 8, "d"), (11, 20, "e")])
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.containing(0), [])
+        self.assertEqual(index.containing(1), ["a"])
+        self.assertEqual(index.containing(4), ["a", "b"])
+        self.assertEqual(index.containing(6), ["a", "c"])
+        self.assertEqual(index.containing(8), ["a", "d"])
+        self.assertEqual(index.containing(10), ["a"])
+        self.assertEqual(index.containing(10.5), [])
+        self.assertEqual(index.containing(20), ["e"])
+        self.assertEqual(index.containing(21), [])
+
+    def test_matches_brute_force(self):
+        """It should agree with checking every interval"""
+        intervals = [(start, start + length, (start, length)) for start in range(0, 50, 3) for length in (0, 2, 7, 30)]
+        index = IntervalIndex(reversed(intervals))
+        for point in range(-1, 90):
+            expected = sorted(item for start, end, item in intervals if start <= point <= end)
+            self.assertEqual(sorted(index.containing(point)), expected)
+
+    def test_sweep(self):
+        """It should answer many points at once in the order they were given"""
+        intervals = [(start, start + length, (start, length)) for start in range(0, 50, 3) for length in (0, 2, 7, 30)]
+        index = IntervalIndex(reversed(intervals))
+        points = [7, -1, 89, 30, 30, 0, 52, 12.5]
+        self.assertEqual(index.sweep(points), [index.containing(point) for point in points])
+        self.assertEqual(index.sweep([]), [])
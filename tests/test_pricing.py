@@ -0,0 +1,66 @@
+"""
+Test cases for the Pricing Engine
+
+"""
+import unittest
+from service.models import PromotionType
+from service.pricing import price_lines, NO_PROMOTION
+
+
+def make_promotion(promotion_id, product_id, type, value):
+    """Creates the pricing terms of a Promotion"""
+    return (promotion_id, product_id, type.value, value)
+
+
+######################################################################
+#  P R I C I N G   T E S T   C A S E S
+######################################################################
+class TestPricing(unittest.TestCase):
+    """ Test Cases for price_lines """
+
+    def test_no_promotions(self):
+        """It should charge full price when nothing applies"""
+        priced = price_lines([1, 2], [10.0, 2.5], [2, 4], [])
+        self.assertEqual(priced["subtotal"].tolist(), [20.0, 10.0])
+        self.assertEqual(priced["discount"].tolist(), [0.0, 0.0])
+        self.assertEqual(priced["total"].tolist(), [20.0, 10.0])
+        self.assertEqual(priced["promotion_id"].tolist(), [NO_PROMOTION, NO_PROMOTION])
+
+    def test_empty_cart(self):
+        """It should price an empty cart"""
+        priced = price_lines([], [], [], [make_promotion(1, 1, PromotionType.BOGO, 0)])
+        self.assertEqual(priced["total"].tolist(), [])
+
+    def test_promotion_types(self):
+        """It should apply BOGO, PERCENTAGE and FIXED discounts"""
+        promotions = [
+            make_promotion(1, 1, PromotionType.BOGO, 0),
+            make_promotion(2, 2, PromotionType.PERCENTAGE, 25),
+            make_promotion(3, 3, PromotionType.FIXED, 3),
+            make_promotion(4, 4, PromotionType.FIXED, 50),
+        ]
+        priced = price_lines([1, 2, 3, 4, 5], [10.0, 8.0, 5.0, 5.0, 1.0], [3, 2, 2, 2, 1], promotions)
+        self.assertEqual(priced["discount"].tolist(), [10.0, 4.0, 6.0, 10.0, 0.0])
+        self.assertEqual(priced["total"].tolist(), [20.0, 12.0, 4.0, 0.0, 1.0])
+        self.assertEqual(priced["promotion_id"].tolist(), [1, 2, 3, 4, NO_PROMOTION])
+
+    def test_best_promotion_wins(self):
+        """It should apply the largest discount when several promotions apply"""
+        promotions = [
+            make_promotion(5, 1, PromotionType.PERCENTAGE, 10),
+            make_promotion(6, 1, PromotionType.BOGO, 0),
+            make_promotion(7, 1, PromotionType.FIXED, 1),
+            make_promotion(8, 2, PromotionType.PERCENTAGE, 10),
+            make_promotion(9, 2, PromotionType.FIXED, 1),
+        ]
+        # one unit gets nothing from BOGO, two units get one free
+        priced = price_lines([1, 1, 2], [10.0, 10.0, 10.0], [1, 2, 1], promotions)
+        self.assertEqual(priced["promotion_id"].tolist(), [5, 6, 8])
+        self.assertEqual(priced["discount"].tolist(), [1.0, 10.0, 1.0])
+
+    def test_many_lines(self):
+        """It should price many lines of the same products"""
+        promotions = [make_promotion(1, 7, PromotionType.PERCENTAGE, 50)]
+        priced = price_lines([7, 8] * 5000, [2.0, 2.0] * 5000, [1, 1] * 5000, promotions)
+        self.assertEqual(priced["discount"].sum(), 5000.0)
+        self.assertEqual(priced["total"].sum(), 15000.0)
@@ -0,0 +1,91 @@
+"""
+Test cases for the SQL Query Log
+
+"""
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine, text
+from service import app
+from service.common.query_log import RequestQueries, current_queries, redact
+
+
+######################################################################
+#  Q U E R Y   L O G   T E S T   C A S E S
+######################################################################
+class TestQueryLog(unittest.TestCase):
+    """ Test Cases for the SQL Query Log """
+
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_request_queries(self):
+        """It should count the statements and keep the slowest"""
+        queries = RequestQueries()
+        queries.add("SELECT 1", 0.002)
+        queries.add("SELECT 2", 0.005)
+        queries.add("SELECT 1", 0.001)
+        self.assertEqual(queries.count, 3)
+        self.assertAlmostEqual(queries.seconds, 0.008)
+        self.assertEqual(queries.slowest, (0.005, "SELECT 2"))
+        self.assertEqual(queries.repeated(2), [("SELECT 1", 2)])
+        self.assertEqual(
+            queries.server_timing(), 'db;dur=8.00;desc="3 queries", db-slowest;dur=5.00;desc="SELECT"'
+        )
+
+    def test_redact(self):
+        """It should log the types of the parameters, not their values"""
+        self.assertEqual(redact(("secret", 5)), ["str", "int"])
+        self.assertEqual(redact({"name": "secret"}), {"name": "str"})
+        self.assertEqual(redact([("a",), ("b",)], executemany=True), "<2 parameter sets>")
+        self.assertEqual(redact(None), [])
+
+    def test_count_request_statements(self):
+        """It should count the statements run during a request"""
+        with app.test_request_context("/"):
+            app.preprocess_request()
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            self.assertEqual(current_queries().count, 2)
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        self.assertIsNone(current_queries())
+
+    def test_slow_query(self):
+        """It should log slow statements without their parameter values"""
+        with patch.dict(app.config, SQL_SLOW_QUERY_MS=0):
+            with self.assertLogs("flask.app", "WARNING") as logs:
+                with self.engine.connect() as connection:
+                    connection.execute(text("SELECT :name"), {"name": "secret"})
+        self.assertIn("Slow query", logs.output[0])
+        self.assertIn("parameters=['str']", logs.output[0])
+        self.assertNotIn("secret", logs.output[0])
+
+    def test_repeated_statements(self):
+        """It should flag a statement repeated in one request as a likely N+1"""
+        with app.test_request_context("/promotions"), patch.dict(app.config, SQL_REPEAT_THRESHOLD=3):
+            app.preprocess_request()
+            with self.engine.connect() as connection:
+                for number in range(3):
+                    connection.execute(text("SELECT :number"), {"number": number})
+                connection.execute(text("SELECT 1"))
+            with self.assertLogs("flask.app", "WARNING") as logs:
+                app.process_response(app.response_class())
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Likely N+1 query in GET /promotions, run 3 times: SELECT ?", logs.output[0])
+
+    def test_timing_headers(self):
+        """It should only send the timing headers in debug mode or when enabled"""
+        for debug, enabled, expected in ((False, False, False), (True, False, True), (False, True, True)):
+            with app.test_request_context("/"), patch.dict(app.config, DEBUG=debug, SQL_TIMING_HEADERS=enabled):
+                app.preprocess_request()
+                with self.engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                response = app.process_response(app.response_class())
+            self.assertEqual("X-DB-Queries" in response.headers, expected)
+            if expected:
+                self.assertEqual(response.headers["X-DB-Queries"], "1")
+                self.assertTrue(response.headers["Server-Timing"].startswith("db;dur="))
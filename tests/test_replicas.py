@@ -0,0 +1,64 @@
+"""
+Test cases for Read Replica routing
+
+"""
+import os
+import tempfile
+import unittest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from service.common.replicas import ReplicaRouter
+
+
+######################################################################
+#  R E P L I C A   R O U T E R   T E S T   C A S E S
+######################################################################
+class TestReplicaRouter(unittest.TestCase):
+    """ Test Cases for ReplicaRouter """
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.folder = tempfile.TemporaryDirectory()
+        self.uris = ["sqlite:///" + os.path.join(self.folder.name, f"replica{i}.db") for i in range(3)]
+
+    def tearDown(self):
+        self.router.dispose()
+        self.folder.cleanup()
+
+    def test_no_replicas(self):
+        """It should choose nothing without replicas"""
+        self.assertIsNone(self.router.choose())
+        self.assertEqual(self.router.stats(), {"replicas": 0, "ejected": []})
+
+    def test_round_robin(self):
+        """It should take turns between the replicas"""
+        self.router.configure(self.uris, {}, 30)
+        chosen = [self.router.choose() for _ in range(6)]
+        self.assertEqual(chosen, self.router.engines * 2)
+
+    def test_eject(self):
+        """It should skip an ejected replica until its time is up"""
+        self.router.configure(self.uris[:2], {}, 30)
+        first, second = self.router.engines
+        self.router.eject(first)
+        self.assertEqual([self.router.choose() for _ in range(3)], [second] * 3)
+        self.assertEqual(len(self.router.stats()["ejected"]), 1)
+        self.router.eject(second)
+        self.assertIsNone(self.router.choose())
+
+        self.router.configure(self.uris[:2], {}, 0)
+        first = self.router.engines[0]
+        self.router.eject(first)
+        self.assertIs(self.router.choose(), first)
+
+    def test_eject_on_connection_error(self):
+        """It should eject a replica it cannot connect to"""
+        missing = "sqlite:///" + os.path.join(self.folder.name, "missing", "replica.db")
+        self.router.configure([missing, self.uris[0]], {}, 30)
+        broken = self.router.choose()
+        with self.assertRaises(OperationalError):
+            with broken.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        self.assertEqual(self.router.stats()["ejected"], [missing])
+        self.assertEqual(self.router.choose(), self.router.engines[1])
+        self.assertEqual(self.router.choose(), self.router.engines[1])
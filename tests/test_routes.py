@@ -7,10 +7,18 @@ Test cases can be run with the following:
 """
 
 import os
+import gzip
+import shutil
+import tempfile
+import json
 import logging
 import unittest
-from service.models import Promotion, DataValidationError, db
+from unittest.mock import patch
+import brotli
+from sqlalchemy import create_engine
+from service.models import Promotion, PromotionType, DataValidationError, db
 from service.common import status
+from service.common import static_assets
 from service import app
 from .factory import PromotionFactory
 from datetime import datetime, timedelta
@@ -33,16 +41,20 @@ class TestPromotionRoutes(unittest.TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         Promotion.init_db(app)
+        cls.app_context = app.app_context()
+        cls.app_context.push()
 
     @classmethod
     def tearDownClass(cls):
         """ This runs once after the entire test suite """
         db.session.close()
+        cls.app_context.pop()
 
     def setUp(self):
         """ This runs before each test """
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        Promotion.cache.clear()
         self.app = app.test_client()
 
     def tearDown(self):
@@ -106,6 +118,139 @@ class TestPromotionRoutes(unittest.TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         response = self.app.post("/promotions", json=test_item.serialize())
         self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn(test_item.name, response.get_json()["message"])
+
+    def test_create_promotion_defaults(self):
+        """It should answer a create with the defaults it stored for null fields"""
+        data = PromotionFactory().serialize()
+        data.update(type="FIXED", value=None, active=None)
+        resp = self.app.post("/promotions", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        created = resp.get_json()
+        self.assertEqual((created["value"], created["active"]), (0, False))
+        Promotion.cache.clear()
+        self.assertEqual(self.app.get("/promotions/{}".format(created["id"])).get_json(), created)
+
+    def test_model_errors_in_production(self):
+        """It should answer 400 and 409 for model errors when exceptions are not propagated"""
+        app.config.update(TESTING=False, DEBUG=False)
+        try:
+            test_item = PromotionFactory()
+            response = self.app.post("/promotions", json=test_item.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = self.app.post("/promotions", json=test_item.serialize())
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(response.get_json()["error"], "Conflict")
+            data = test_item.serialize()
+            data["product_id"] = "seven"
+            response = self.app.post("/promotions", json=data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.get_json()["error"], "Bad Request")
+        finally:
+            app.config.update(TESTING=True, DEBUG=True)
+
+    def test_upsert_promotion(self):
+        """It should overwrite a Promotion with the same name when upserting"""
+        test_item = PromotionFactory()
+        response = self.app.post("/promotions", query_string="upsert=true", json=test_item.serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.get_json()
+        test_item.value = 50
+        test_item.type = PromotionType.PERCENTAGE
+        response = self.app.post("/promotions", query_string="upsert=true", json=test_item.serialize())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], '"{}-2"'.format(created["id"]))
+        self.assertEqual(response.get_json()["id"], created["id"])
+        response = self.app.get("/promotions/{}".format(created["id"]))
+        self.assertEqual(response.get_json()["value"], 50)
+
+    def test_bulk_create_promotions(self):
+        """ It should create many Promotions in one request """
+        promotions = [PromotionFactory().serialize() for _ in range(3)]
+        resp = self.app.post("/promotions/bulk", json=promotions)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 3)
+        self.assertEqual(data["errors"], 0)
+        for result, promotion in zip(data["results"], promotions):
+            created = self.app.get("/promotions/{}".format(result["id"])).get_json()
+            self.assertEqual(created["name"], promotion["name"])
+
+    def test_bulk_create_with_errors(self):
+        """ It should report an error for every invalid row and create the rest """
+        existing = self._create_promotions(1)[0]
+        valid = PromotionFactory().serialize()
+        missing = PromotionFactory().serialize()
+        del missing["product_id"]
+        duplicate = PromotionFactory().serialize()
+        duplicate["name"] = existing.name
+        resp = self.app.post("/promotions/bulk", json=[valid, missing, duplicate, valid, "nope"])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(data["errors"], 4)
+        self.assertIn("id", data["results"][0])
+        self.assertEqual([result["index"] for result in data["results"] if "error" in result], [1, 2, 3, 4])
+
+        resp = self.app.post("/promotions/bulk", json=[missing])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/bulk", json={"name": "not a list"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_rejects_bad_types(self):
+        """ It should report every row with a field of the wrong type and create the rest """
+        valid = PromotionFactory().serialize()
+        rows = [
+            dict(PromotionFactory().serialize(), start_date=5),
+            dict(PromotionFactory().serialize(), type=5),
+            dict(PromotionFactory().serialize(), start_date=None),
+            dict(PromotionFactory().serialize(), value="x"),
+            valid,
+        ]
+        resp = self.app.post("/promotions/bulk", json=rows)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual((data["created"], data["errors"]), (1, 4))
+        self.assertEqual([result["index"] for result in data["results"] if "error" in result], [0, 1, 2, 3])
+        self.assertIn("start_date", data["results"][0]["error"])
+
+    def test_bulk_create_gzip_limit(self):
+        """ It should refuse a gzip body that decompresses past the size limit """
+        body = gzip.compress(json.dumps([PromotionFactory().serialize()]).encode() + b" " * 4096)
+        max_bytes = app.config["BULK_MAX_BYTES"]
+        app.config["BULK_MAX_BYTES"] = 1024
+        try:
+            resp = self.app.post(
+                "/promotions/bulk", data=body, content_type="application/json", headers={"Content-Encoding": "gzip"}
+            )
+        finally:
+            app.config["BULK_MAX_BYTES"] = max_bytes
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("1024 bytes", resp.get_json()["message"])
+        resp = self.app.post(
+            "/promotions/bulk", data=body[:-8], content_type="application/json", headers={"Content-Encoding": "gzip"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_ndjson_gzip(self):
+        """ It should accept a gzip encoded NDJSON body """
+        promotions = [PromotionFactory().serialize() for _ in range(3)]
+        body = gzip.compress("\n".join(json.dumps(promotion) for promotion in promotions).encode())
+        resp = self.app.post(
+            "/promotions/bulk", data=body, content_type="application/x-ndjson",
+            headers={"Content-Encoding": "gzip"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["created"], 3)
+        self.assertEqual(len(self.app.get("/promotions").get_json()), 3)
+
+        resp = self.app.post(
+            "/promotions/bulk", data=b"not gzip", content_type="application/x-ndjson",
+            headers={"Content-Encoding": "gzip"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/bulk", data="{}", content_type="text/csv")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
     def test_get_promotion(self):
         """ Get a single Promotion """
@@ -134,6 +279,451 @@ class TestPromotionRoutes(unittest.TestCase):
         self.assertEqual(data[0]['id'], test_promotion00.id)
         self.assertEqual(data[1]['id'], test_promotion01.id)
 
+    def test_list_promotion_paginated(self):
+        """ It should page through promotions with a keyset cursor """
+        promotions = self._create_promotions(5)
+        resp = self.app.get("/promotions", query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([promo['id'] for promo in data], [promotions[0].id, promotions[1].id])
+        self.assertIn('rel="next"', resp.headers["Link"])
+        self.assertIn("after={}".format(promotions[1].id), resp.headers["Link"])
+
+        resp = self.app.get("/promotions", query_string="limit=2&after={}".format(promotions[3].id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([promo['id'] for promo in data], [promotions[4].id])
+        self.assertNotIn("Link", resp.headers)
+
+        resp = self.app.get("/promotions", query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_promotion_page_size_capped(self):
+        """ It should never return more than the maximum page size """
+        self._create_promotions(3)
+        page_size_max = app.config["PAGE_SIZE_MAX"]
+        app.config["PAGE_SIZE_MAX"] = 2
+        try:
+            resp = self.app.get("/promotions", query_string="limit=50")
+        finally:
+            app.config["PAGE_SIZE_MAX"] = page_size_max
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn("limit=2", resp.headers["Link"])
+
+    def test_list_promotion_total_count(self):
+        """ It should return an estimated X-Total-Count when asked """
+        promotions = self._create_promotions(3)
+        resp = self.app.get("/promotions", query_string="count=true&limit=1")
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        resp = self.app.get("/promotions", query_string="name={}&count=true".format(promotions[0].name))
+        self.assertEqual(resp.headers["X-Total-Count"], "1")
+        resp = self.app.get("/promotions")
+        self.assertNotIn("X-Total-Count", resp.headers)
+
+    def test_list_promotion_ndjson(self):
+        """ It should stream promotions as newline delimited JSON """
+        promotions = self._create_promotions(3)
+        resp = self.app.get("/promotions", headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertTrue(resp.is_streamed)
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [promo.id for promo in promotions])
+
+    def test_compress_list(self):
+        """ It should compress large listings with the encoding the client prefers """
+        self._create_promotions(20)
+        resp = self.app.get("/promotions")
+        expected = resp.get_json()
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+
+        resp = self.app.get("/promotions", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), expected)
+
+        resp = self.app.get("/promotions", headers={"Accept-Encoding": "gzip;q=0.5, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(json.loads(brotli.decompress(resp.data)), expected)
+
+        # each encoding is its own representation, and revalidates with its own tag
+        identity_etag = self.app.get("/promotions").headers["ETag"]
+        self.assertEqual(resp.headers["ETag"], identity_etag[:-1] + '-br"')
+        resp = self.app.get("/promotions", headers={"Accept-Encoding": "br", "If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], identity_etag[:-1] + '-br"')
+
+        # small responses are not worth compressing
+        resp = self.app.get("/promotions", query_string="limit=1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.app.get("/health", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compress_stream(self):
+        """ It should compress a streamed listing chunk by chunk """
+        self._create_promotions(3)
+        expected = self.app.get("/promotions").get_json()
+        with patch.dict(app.config, {"STREAM_BATCH_SIZE": 1}):
+            resp = self.app.get("/promotions", query_string="stream=true", headers={"Accept-Encoding": "gzip"})
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), expected)
+
+    def test_built_assets(self):
+        """ It should serve the built assets precompressed and cached forever """
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        static = os.path.join(folder, "static")
+        shutil.copytree(app.static_folder, static, ignore=shutil.ignore_patterns(static_assets.DIST_FOLDER))
+        manifest = static_assets.build(static)
+        self.addCleanup(setattr, app, "static_folder", app.static_folder)
+        app.static_folder = static
+        resp = self.app.get("/")
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+        self.assertIn(manifest["js/rest_api.js"], resp.get_data(as_text=True))
+        resp.close()
+
+        url = "/assets/" + manifest["js/rest_api.js"]
+        resp = self.app.get(url, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertTrue(resp.mimetype.endswith("javascript"))
+        resp.close()
+        resp = self.app.get(url, headers={"Accept-Encoding": "gzip, br;q=0"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        resp.close()
+        resp = self.app.get(url)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp.close()
+
+        self.assertEqual(self.app.get("/assets/manifest.json").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.app.get("/assets/js/missing.js").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_promotion_stream(self):
+        """ It should stream promotions as a chunked JSON array """
+        promotions = self._create_promotions(3)
+        batch_size = app.config["STREAM_BATCH_SIZE"]
+        app.config["STREAM_BATCH_SIZE"] = 2
+        try:
+            resp = self.app.get("/promotions", query_string="stream=true&after={}".format(promotions[0].id))
+            data = resp.get_json()
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = batch_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([promo['id'] for promo in data], [promo.id for promo in promotions[1:]])
+        self.assertEqual(data[0]['name'], promotions[1].name)
+
+        resp = self.app.get("/promotions", query_string="stream=true&name=nobody")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_get_promotion_not_modified(self):
+        """ It should answer If-None-Match with 304 until the Promotion changes """
+        test_promotion = self._create_promotions(1)[0]
+        url = "/promotions/{}".format(test_promotion.id)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        self.assertEqual(etag, '"{}-1"'.format(test_promotion.id))
+        self.assertIn("Last-Modified", resp.headers)
+
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+
+        self.app.put("{}/activate".format(url))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], '"{}-2"'.format(test_promotion.id))
+
+    def test_update_promotion_if_match(self):
+        """ It should only update when If-Match names the current version """
+        test_promotion = self._create_promotions(1)[0]
+        url = "/promotions/{}".format(test_promotion.id)
+        resp = self.app.get(url)
+        data = resp.get_json()
+        etag = resp.headers["ETag"]
+        data["name"] = "first"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        data["name"] = "second"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.app.get(url).get_json()["name"], "first")
+
+    def test_update_promotion_lost_race(self):
+        """ It should write to the current version of a Promotion changed by another worker """
+        test_promotion = self._create_promotions(1)[0]
+        url = "/promotions/{}".format(test_promotion.id)
+        resp = self.app.get(url)
+        data, stale_etag = resp.get_json(), resp.headers["ETag"]
+        # another worker bumps the version behind this worker's cache
+        db.session.execute(
+            Promotion.__table__.update().values(version=Promotion.version + 1)
+        )
+        db.session.commit()
+        data["name"] = "stale"
+        resp = self.app.put(url, json=data, headers={"If-Match": stale_etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(url, json=data, headers={"If-Match": '"{}-2"'.format(test_promotion.id)})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], '"{}-3"'.format(test_promotion.id))
+
+        self.app.get(url)
+        db.session.execute(Promotion.__table__.update().values(version=Promotion.version + 1))
+        db.session.commit()
+        resp = self.app.put("{}/activate".format(url))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.app.get(url)
+        db.session.execute(Promotion.__table__.update().values(version=Promotion.version + 1))
+        db.session.commit()
+        resp = self.app.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_promotion_not_modified(self):
+        """ It should answer a listing's If-None-Match with 304 until anything changes """
+        test_promotion = self._create_promotions(2)[0]
+        resp = self.app.get("/promotions")
+        etag = resp.headers["ETag"]
+        # the tag comes from the page's rows, not from an aggregate over the listing
+        self.assertEqual(resp.headers["X-DB-Queries"], "1")
+        resp = self.app.get("/promotions", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get("/promotions", query_string="limit=1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        self.app.put("/promotions/{}/activate".format(test_promotion.id))
+        resp = self.app.get("/promotions", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        self.app.delete("/promotions/{}".format(test_promotion.id))
+        resp = self.app.get("/promotions", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_list_large_product(self):
+        """ It should page a product with more Promotions than the cache holds from the database """
+        promotions = self._create_promotions(3)
+        Promotion.query.update({"product_id": 7})
+        db.session.commit()
+        Promotion.cache.clear()
+        with patch.dict(app.config, {"PROMOTION_CACHE_PRODUCT_ROWS": 2}):
+            resp = self.app.get("/promotions", query_string="product_id=7&limit=2")
+            self.assertEqual([promo["id"] for promo in resp.get_json()], [promo.id for promo in promotions[:2]])
+            self.assertIn("after={}".format(promotions[1].id), resp.headers["Link"])
+            resp = self.app.get("/promotions", query_string="product_id=7&limit=2&after={}".format(promotions[1].id))
+            self.assertEqual([promo["id"] for promo in resp.get_json()], [promotions[2].id])
+        self.assertIs(Promotion.cache.get(("product_id", 7)), False)
+
+    def test_list_product_not_modified_from_cache(self):
+        """ It should tag a cached product listing by the rows it serves """
+        test_promotion = self._create_promotions(1)[0]
+        query_string = "product_id={}".format(test_promotion.product_id)
+        resp = self.app.get("/promotions", query_string=query_string)
+        etag, value = resp.headers["ETag"], resp.get_json()[0]["value"]
+        # another worker changes the Promotion behind this worker's cache
+        db.session.execute(
+            Promotion.__table__.update().values(value=77, version=Promotion.version + 1)
+        )
+        db.session.commit()
+        resp = self.app.get("/promotions", query_string=query_string)
+        self.assertEqual((resp.headers["ETag"], resp.get_json()[0]["value"]), (etag, value))
+
+        # once the cached rows expire the old tag no longer matches
+        Promotion.cache.clear()
+        resp = self.app.get("/promotions", query_string=query_string, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[0]["value"], 77)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_list_available_promotions(self):
+        """ It should list the active Promotions of a product available at a time """
+        test_promotion = self._create_promotions(1)[0]
+        query_string = "product_id={}&at={}".format(test_promotion.product_id, "2022-10-17T12:00:00")
+        resp = self.app.get("/promotions/available", query_string=query_string)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+        self.app.put("/promotions/{}/activate".format(test_promotion.id))
+        resp = self.app.get("/promotions/available", query_string=query_string)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([promo["id"] for promo in resp.get_json()], [test_promotion.id])
+
+        resp = self.app.get("/promotions/available", query_string="product_id={}".format(test_promotion.product_id))
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.get("/promotions/available", query_string="product_id=1&at=whenever")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/promotions/available")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_promotions_available_at(self):
+        """ It should list the Promotions available at a past time """
+        test_promotion = self._create_promotions(1)[0]
+        resp = self.app.get("/promotions", query_string="at=2022-10-17T12:00:00")
+        self.assertEqual([promo["id"] for promo in resp.get_json()], [test_promotion.id])
+        resp = self.app.get("/promotions", query_string="at=2022-10-19")
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.get("/promotions", query_string="at=whenever")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_available_promotions_at_times(self):
+        """ It should find the Promotions available at many times at once """
+        test_promotion = self._create_promotions(1)[0]
+        timestamps = ["2022-10-19", "2022-10-17T12:00:00"]
+        resp = self.app.post("/promotions/available", json={"timestamps": timestamps})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [
+            {"at": "2022-10-19", "promotion_ids": []},
+            {"at": "2022-10-17T12:00:00", "promotion_ids": [test_promotion.id]},
+        ])
+        resp = self.app.post(
+            "/promotions/available", query_string="product_id={}".format(test_promotion.product_id + 1),
+            json={"timestamps": timestamps}
+        )
+        self.assertEqual([row["promotion_ids"] for row in resp.get_json()], [[], []])
+
+        resp = self.app.post("/promotions/available", json={"timestamps": [1]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/available", json={"timestamps": ["whenever"]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/available", data="timestamps", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_read_your_writes(self):
+        """ It should read a client's own writes from the primary """
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        uri = "sqlite:///" + os.path.join(folder.name, "replica.db")
+        engine = create_engine(uri)
+        Promotion.__table__.create(engine)
+        engine.dispose()
+        db.replicas.configure([uri], {}, 30)
+        self.addCleanup(db.replicas.configure, [], {}, 30)
+
+        test_promotion = self._create_promotions(1)[0]
+        url = "/promotions/{}".format(test_promotion.id)
+        # the client that wrote reads from the primary for a while
+        Promotion.cache.clear()
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_200_OK)
+        Promotion.cache.clear()
+        other_client = app.test_client()
+        self.assertEqual(other_client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        resp = other_client.get(url, headers={"X-Read-Your-Writes": "true"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(other_client.get("/diagnostics").get_json()["replicas"]["replicas"], 1)
+
+        # posted searches only read, so they use the replicas and pin nobody to the primary
+        Promotion.cache.clear()
+        reader = app.test_client()
+        resp = reader.post("/promotions/lookup", json={"product_ids": [test_promotion.product_id]})
+        self.assertEqual(resp.get_json()[str(test_promotion.product_id)], [])
+        self.assertNotIn("Set-Cookie", resp.headers)
+        self.assertEqual(reader.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_best_promotion(self):
+        """ It should return the best Promotion of a product """
+        test_promotion = self._create_promotions(1)[0]
+        query = "product_id={}&at={}".format(test_promotion.product_id, "2022-10-17T12:00:00")
+        resp = self.app.get("/promotions/best", query_string=query)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.app.put("/promotions/{}/activate".format(test_promotion.id))
+        resp = self.app.get("/promotions/best", query_string=query)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], test_promotion.id)
+        resp = self.app.get("/promotions/best", query_string=query + "&unit_price=2.5")
+        self.assertEqual(resp.get_json()["id"], test_promotion.id)
+
+        resp = self.app.get("/promotions/best", query_string=query + "&unit_price=-1")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/promotions/best")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lookup_promotions(self):
+        """ It should return the Promotions of many products at once """
+        promotions = self._create_promotions(2)
+        other = PromotionFactory()
+        other.product_id = promotions[0].product_id + 1
+        resp = self.app.post("/promotions", json=other.serialize())
+        other_id = resp.get_json()["id"]
+
+        product_id = promotions[0].product_id
+        resp = self.app.post("/promotions/lookup", json={"product_ids": [product_id, product_id + 1, product_id + 2]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([promo["id"] for promo in data[str(product_id)]], [promo.id for promo in promotions])
+        self.assertEqual([promo["id"] for promo in data[str(product_id + 1)]], [other_id])
+        self.assertEqual(data[str(product_id + 2)], [])
+
+        resp = self.app.post(
+            "/promotions/lookup", json={"product_ids": [product_id], "available_at": "2022-10-17T12:00:00"}
+        )
+        self.assertEqual(len(resp.get_json()[str(product_id)]), 2)
+        resp = self.app.post(
+            "/promotions/lookup", json={"product_ids": [product_id], "available_at": "2022-11-17"}
+        )
+        self.assertEqual(resp.get_json()[str(product_id)], [])
+
+    def test_lookup_promotions_bad_request(self):
+        """ It should reject lookups that are malformed or too large """
+        resp = self.app.post("/promotions/lookup", json={"product_ids": ["1"]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/lookup", json=[1, 2])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/lookup", json={"product_ids": [1], "available_at": "whenever"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for available_at in (5, "", ["2022-10-17"]):
+            resp = self.app.post("/promotions/lookup", json={"product_ids": [1], "available_at": available_at})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        max_products = app.config["LOOKUP_MAX_PRODUCTS"]
+        app.config["LOOKUP_MAX_PRODUCTS"] = 2
+        try:
+            resp = self.app.post("/promotions/lookup", json={"product_ids": [1, 2, 3]})
+        finally:
+            app.config["LOOKUP_MAX_PRODUCTS"] = max_products
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_price_cart(self):
+        """ It should price a cart with the best available Promotion of each line """
+        test_promotion = self._create_promotions(1)[0]
+        self.app.put("/promotions/{}/activate".format(test_promotion.id))
+        cart = {
+            "lines": [
+                {"product_id": test_promotion.product_id, "unit_price": 100, "quantity": 2},
+                {"product_id": test_promotion.product_id + 1, "unit_price": 9.99, "quantity": 1},
+            ],
+            "at": "2022-10-17T12:00:00",
+        }
+        resp = self.app.post("/promotions/price", json=cart)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["lines"][0]["promotion_id"], test_promotion.id)
+        self.assertGreater(data["lines"][0]["discount"], 0)
+        self.assertIsNone(data["lines"][1]["promotion_id"])
+        self.assertEqual(data["lines"][1]["total"], 9.99)
+        self.assertEqual(data["subtotal"], 209.99)
+        self.assertEqual(data["total"], round(data["subtotal"] - data["discount"], 2))
+
+        # the promotion has expired by now
+        del cart["at"]
+        resp = self.app.post("/promotions/price", json=cart)
+        self.assertEqual(resp.get_json()["discount"], 0)
+
+    def test_price_cart_bad_request(self):
+        """ It should reject carts that are not valid """
+        resp = self.app.post("/promotions/price", json={"lines": [{"product_id": 1, "quantity": 1}]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/price", json={"lines": [{"product_id": 1, "unit_price": 1, "quantity": -1}]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/price", json={"lines": "everything"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/promotions/price", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for at in (5, "", ["2022-11-10"]):
+            resp = self.app.post("/promotions/price", json={"lines": [{"product_id": 1, "unit_price": 1}], "at": at})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_list_promotion_by_type(self):
         # get the type of a promotion
         test_promotion_type = self._create_promotions(1)[0]
@@ -210,6 +800,70 @@ class TestPromotionRoutes(unittest.TestCase):
         for promo in data:
             self.assertEqual(promo["active"], False)
 
+    def test_list_promotion_combined_filters(self):
+        """ It should AND together every query string filter """
+        promotions = self._create_promotions(3)
+        self.app.put("/promotions/{}/activate".format(promotions[0].id))
+        product_id = promotions[0].product_id
+        resp = self.app.get("/promotions", query_string="product_id={}&active=true".format(product_id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([promo['id'] for promo in data], [promotions[0].id])
+
+        resp = self.app.get("/promotions", query_string="product_id={}&active=false".format(product_id))
+        data = resp.get_json()
+        self.assertEqual([promo['id'] for promo in data], [promo.id for promo in promotions[1:]])
+
+        resp = self.app.get("/promotions", query_string="name={}&active=false".format(promotions[0].name))
+        self.assertEqual(resp.get_json(), [])
+
+        resp = self.app.get("/promotions", query_string="available=true")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_list_promotion_sorted(self):
+        """ It should sort promotions and keep paging in sort order """
+        promotions = self._create_promotions(3)
+        names = ["b", "c", "a"]
+        for promotion, name in zip(promotions, names):
+            data = self.app.get("/promotions/{}".format(promotion.id)).get_json()
+            data["name"] = name
+            self.app.put("/promotions/{}".format(promotion.id), json=data)
+
+        resp = self.app.get("/promotions", query_string="sort=name&limit=2")
+        self.assertEqual([promo['name'] for promo in resp.get_json()], ["a", "b"])
+        resp = self.app.get("/promotions", query_string="sort=name&limit=2&after={}".format(promotions[0].id))
+        self.assertEqual([promo['name'] for promo in resp.get_json()], ["c"])
+        resp = self.app.get("/promotions", query_string="sort=-name")
+        self.assertEqual([promo['name'] for promo in resp.get_json()], ["c", "b", "a"])
+
+        resp = self.app.get("/promotions", query_string="sort=bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/promotions", query_string="type=bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_promotion_sorted_with_nulls(self):
+        """ It should page through every promotion when the sort column has NULLs """
+        promotions = self._create_promotions(5)
+        db.session.query(Promotion).filter(
+            Promotion.id.in_([promotions[1].id, promotions[3].id])
+        ).update({"value": None}, synchronize_session=False)
+        db.session.commit()
+        for sort in ("value", "-value"):
+            seen = []
+            query_string = "sort={}&limit=1".format(sort)
+            while True:
+                resp = self.app.get("/promotions", query_string=query_string)
+                seen.extend(promo['id'] for promo in resp.get_json())
+                if "Link" not in resp.headers:
+                    break
+                query_string = "sort={}&limit=1&after={}".format(sort, seen[-1])
+            self.assertEqual(sorted(seen), sorted(promotion.id for promotion in promotions))
+            # NULLs come last ascending and first descending
+            if sort == "value":
+                self.assertEqual(seen[-2:], [promotions[1].id, promotions[3].id])
+            else:
+                self.assertEqual(seen[:2], [promotions[3].id, promotions[1].id])
+
     def test_update_promotion(self):
         """ Update an existing Promotion """
         # create a promotion to update
@@ -239,6 +893,27 @@ class TestPromotionRoutes(unittest.TestCase):
         )
         self.assertEqual(invalid_resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_promotion_nulls_and_constraints(self):
+        """ It should apply the defaults for null fields and reject constraint violations """
+        first, second = self._create_promotions(2)
+        url = "/promotions/{}".format(first.id)
+        data = self.app.get(url).get_json()
+        data.update(type="FIXED", value=None, active=None)
+        resp = self.app.put(url, json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual((resp.get_json()["value"], resp.get_json()["active"]), (0, False))
+
+        data = resp.get_json()
+        resp = self.app.put(url, json=dict(data, start_date=None))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put(url, json=dict(data, name=second.name))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        # the failed writes were rolled back, so the session still works
+        Promotion.cache.clear()
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["name"], first.name)
+
     def test_delete_promotion(self):
         """ Delete a Promotion """
         test_promotion = self._create_promotions(1)[0]
@@ -254,6 +929,43 @@ class TestPromotionRoutes(unittest.TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_bulk_update_promotions(self):
+        """ It should update every matching Promotion in one request """
+        promotions = self._create_promotions(3)
+        resp = self.app.patch("/promotions", query_string="expired=true", json={"active": True, "value": 40})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["updated"], 3)
+        for promotion in promotions:
+            data = self.app.get("/promotions/{}".format(promotion.id)).get_json()
+            self.assertEqual(data["active"], True)
+            self.assertEqual(data["value"], 40)
+
+        resp = self.app.patch("/promotions", query_string="expired=false", json={"active": False})
+        self.assertEqual(resp.get_json()["updated"], 0)
+        resp = self.app.patch("/promotions", json={"active": False})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.patch("/promotions", query_string="all=true", json={"name": "same"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.patch("/promotions", query_string="all=true", json={"type": "bogus"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.patch("/promotions", query_string="all=true", data="{}", content_type="text/html")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_bulk_delete_promotions(self):
+        """ It should delete every matching Promotion in one request """
+        promotions = self._create_promotions(3)
+        resp = self.app.delete("/promotions", query_string="name={}".format(promotions[0].name))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["deleted"], 1)
+        resp = self.app.get("/promotions/{}".format(promotions[0].id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.app.delete("/promotions")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.delete("/promotions", query_string="all=true")
+        self.assertEqual(resp.get_json()["deleted"], 2)
+        self.assertEqual(self.app.get("/promotions").get_json(), [])
+
     def test_bad_request(self):
         """It should not Create when sending the wrong data"""
         test_promotion = PromotionFactory()
@@ -275,6 +987,65 @@ class TestPromotionRoutes(unittest.TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
+    def test_diagnostics(self):
+        """ It should report the lookup cache counters """
+        test_promotion = self._create_promotions(1)[0]
+        self.app.get("/promotions/{}".format(test_promotion.id))
+        self.app.get("/promotions/{}".format(test_promotion.id))
+        resp = self.app.get("/diagnostics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        cache = resp.get_json()["cache"]
+        self.assertGreaterEqual(cache["hits"], 1)
+        self.assertGreaterEqual(cache["size"], 1)
+        self.assertIn("pool", resp.get_json())
+        self.assertIn("import_seconds", resp.get_json()["startup"])
+
+    def test_metrics(self):
+        """ It should report request, query, cache and pool metrics for Prometheus """
+        test_promotion = self._create_promotions(1)[0]
+        self.app.get("/promotions/{}".format(test_promotion.id))
+        self.app.get("/promotions/0")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",route="PromotionResource",status="200"}', text
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",route="PromotionResource",status="404"}', text
+        )
+        self.assertIn('http_request_duration_seconds_count{method="POST",route="PromotionCollection"', text)
+        self.assertIn('http_response_size_bytes_count{route="PromotionResource"}', text)
+        self.assertIn("http_requests_in_flight 1.0", text)
+        self.assertIn('db_query_duration_seconds_count{operation="SELECT"}', text)
+        self.assertIn('promotion_cache_events_total{event="hits"}', text)
+        self.assertIn("promotion_cache_entries", text)
+
+    def test_query_headers(self):
+        """ It should report the statements of a request in debug mode """
+        test_promotion = PromotionFactory()
+        resp = self.app.post("/promotions", json=test_promotion.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertGreaterEqual(int(resp.headers["X-DB-Queries"]), 1)
+        self.assertIn("db;dur=", resp.headers["Server-Timing"])
+
+    def test_list_promotion_by_product_id_cached(self):
+        """ It should see new Promotions for a product that is cached """
+        test_promotion = self._create_promotions(1)[0]
+        resp = self.app.get("/promotions", query_string="product_id={}".format(test_promotion.product_id))
+        self.assertEqual(len(resp.get_json()), 1)
+        new_promotion = PromotionFactory()
+        new_promotion.product_id = test_promotion.product_id
+        self.app.post("/promotions", json=new_promotion.serialize())
+        resp = self.app.get("/promotions", query_string="product_id={}&limit=1".format(test_promotion.product_id))
+        self.assertEqual([promo["id"] for promo in resp.get_json()], [test_promotion.id])
+        self.assertIn("after={}".format(test_promotion.id), resp.headers["Link"])
+        resp = self.app.get(
+            "/promotions", query_string="product_id={}&after={}".format(test_promotion.product_id, test_promotion.id)
+        )
+        self.assertEqual([promo["name"] for promo in resp.get_json()], [new_promotion.name])
+
     def test_health_check(self):
         """health endpoint should return {"status":"OK}, 200"""
         resp = self.app.get("/health")
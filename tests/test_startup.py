@@ -0,0 +1,33 @@
+"""
+Test cases for starting the service
+
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+######################################################################
+#  S T A R T U P   T E S T   C A S E S
+######################################################################
+class TestStartup(unittest.TestCase):
+    """ Test Cases for importing and creating the app """
+
+    def test_import_does_not_connect(self):
+        """It should import the service without touching the database"""
+        with tempfile.TemporaryDirectory() as folder:
+            database = os.path.join(folder, "lazy.db")
+            script = (
+                "import json, service\n"
+                "assert service.create_app() is service.app\n"
+                "print(json.dumps(service.startup_times))\n"
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", script], capture_output=True, text=True, check=False,
+                env=dict(os.environ, DATABASE_URI="sqlite:///" + database),
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertFalse(os.path.exists(database))
+            self.assertIn("startup_seconds", result.stdout)
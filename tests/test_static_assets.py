@@ -0,0 +1,64 @@
+"""
+Test cases for the Static Asset build
+
+"""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import brotli
+from service.common import static_assets
+
+
+######################################################################
+#  S T A T I C   A S S E T   T E S T   C A S E S
+######################################################################
+class TestStaticAssets(unittest.TestCase):
+    """ Test Cases for the static asset build """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "css"))
+        os.makedirs(os.path.join(self.folder, "images"))
+        with open(os.path.join(self.folder, "css", "site.css"), "w", encoding="utf-8") as file:
+            file.write("body { color: black; }\n" * 100)
+        with open(os.path.join(self.folder, "images", "icon.png"), "wb") as file:
+            file.write(b"\x89PNG" + bytes(range(256)))
+        with open(os.path.join(self.folder, "index.html"), "w", encoding="utf-8") as file:
+            file.write('<link href="static/css/site.css"><img src="static/images/icon.png">')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_hashed_name(self):
+        """It should put a hash of the content before the extension"""
+        self.assertRegex(static_assets.hashed_name("js/app.min.js", b"x"), r"^js/app\.min\.[0-9a-f]{12}\.js$")
+        self.assertNotEqual(static_assets.hashed_name("a.js", b"x"), static_assets.hashed_name("a.js", b"y"))
+
+    def test_build(self):
+        """It should write hashed and precompressed assets and link them from the index"""
+        manifest = static_assets.build(self.folder)
+        self.assertEqual(sorted(manifest), ["css/site.css", "images/icon.png"])
+        dist = os.path.join(self.folder, static_assets.DIST_FOLDER)
+        css = os.path.join(dist, manifest["css/site.css"])
+        with open(css, "rb") as file:
+            content = file.read()
+        with open(css + ".gz", "rb") as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+        with open(css + ".br", "rb") as file:
+            self.assertEqual(brotli.decompress(file.read()), content)
+        # images are compressed already
+        self.assertFalse(os.path.exists(os.path.join(dist, manifest["images/icon.png"]) + ".gz"))
+
+        with open(os.path.join(dist, static_assets.INDEX), encoding="utf-8") as file:
+            index = file.read()
+        self.assertIn("assets/" + manifest["css/site.css"], index)
+        self.assertNotIn("static/", index)
+        with open(os.path.join(dist, static_assets.MANIFEST), encoding="utf-8") as file:
+            self.assertEqual(json.load(file), manifest)
+
+        # building again replaces the last build
+        self.assertEqual(static_assets.build(self.folder), manifest)
+        self.assertFalse(os.path.isdir(os.path.join(dist, static_assets.DIST_FOLDER)))
@@ -0,0 +1,60 @@
+"""
+Test cases for the Timed Queue Pool
+
+"""
+import os
+import tempfile
+import unittest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.common.timed_pool import TimedQueuePool
+
+
+######################################################################
+#  T I M E D   Q U E U E   P O O L   T E S T   C A S E S
+######################################################################
+class TestTimedQueuePool(unittest.TestCase):
+    """ Test Cases for TimedQueuePool """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.engine = create_engine(
+            "sqlite:///" + self.path, poolclass=TimedQueuePool, pool_size=2, max_overflow=1, pool_timeout=0.05
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_stats(self):
+        """It should count checkouts, overflow and waits"""
+        connections = [self.engine.connect() for _ in range(3)]
+        connections[0].execute(text("SELECT 1"))
+        stats = self.engine.pool.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["checked_out"], 3)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["checkouts"], 3)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0)
+        for connection in connections:
+            connection.close()
+        stats = self.engine.pool.stats()
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["timeouts"], 0)
+
+    def test_timeout(self):
+        """It should count checkouts that time out"""
+        connections = [self.engine.connect() for _ in range(3)]
+        self.assertRaises(PoolTimeoutError, self.engine.connect)
+        stats = self.engine.pool.stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.05)
+        for connection in connections:
+            connection.close()
+
+    def test_recreate(self):
+        """It should keep its counters when the pool is recreated"""
+        self.engine.connect().close()
+        self.engine.dispose()
+        self.assertEqual(self.engine.pool.stats()["checkouts"], 1)